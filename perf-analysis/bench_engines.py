@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# bench_engines.py: benchmark the skyline engines against each other
+# on synthetic data at different dimensions
+#
+# Usage: PYTHONPATH=../skyline python bench_engines.py [--points N]
+#            [--dims 2,4,6,8] [--engines bnl,kdtree]
+#            [--dist discrete --card 64]
+
+# stdlib
+import argparse
+import random
+import time
+
+# local imports (from the skyline directory, see the usage above)
+from bitmap_skyline import BitmapSkyline
+from engines import make_skyline
+from skyline import SkyPoint, SkylineException
+
+
+def make_points(num_points, dims, dist='independent', seed=0, card=64):
+    """Create num_points random points with dims dimensions
+
+    dist can be independent (uniform in each dimension), anticorrelated
+    (points close to the plane where the coordinates sum to a
+    constant, which gives a large skyline) or discrete (anticorrelated
+    integers from 0 to card - 1, like the KDD count columns)
+
+    """
+    rand = random.Random(seed)
+    points = []
+    for idx in range(num_points):
+        if dist == 'anticorrelated':
+            data = [rand.random() for dim in range(dims)]
+            total = sum(data)
+            data = [int(1000 * val / total) + rand.randint(0, 20)
+                    for val in data]
+        elif dist == 'discrete':
+            data = [rand.random() for dim in range(dims)]
+            total = sum(data)
+            data = [min(card - 1, int(card * val / total) +
+                        rand.randint(0, card // 16))
+                    for val in data]
+        else:
+            data = [rand.randint(0, 1000) for dim in range(dims)]
+        points.append(SkyPoint(idx / 1000, data))
+    return points
+
+
+def bench(engine, points, dims, card=None):
+    """Return (points per second, skyline size) for the engine"""
+    if engine == 'bitmap':
+        sky = BitmapSkyline(cards=[card] * dims)
+    else:
+        sky = make_skyline(engine, dims=dims)
+    start = time.time()
+    for point in points:
+        sky.update_sky_for_point(point)
+    elapsed = time.time() - start
+    return len(points) / elapsed, len(sky.skyline)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='bench-engines')
+    parser.add_argument('--points', type=int, default=10000,
+                        help='number of points to run through each engine')
+    parser.add_argument('--dims', default='2,4,6,8',
+                        help='comma separated list of dimensions')
+    parser.add_argument('--engines', default='bnl,vector,staircase,kdtree',
+                        help='comma separated list of engines')
+    parser.add_argument('--dist', default='independent',
+                        help='independent, anticorrelated or discrete')
+    parser.add_argument('--card', type=int, default=64,
+                        help='number of values per dimension for the '
+                        'discrete distribution and the bitmap engine')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    dims = [int(dim) for dim in args.dims.split(",")]
+    engines = args.engines.split(",")
+
+    print "{:>6} {:>10} {:>12} {:>10}".format("dims", "engine", "points/s",
+                                              "sky size")
+    for dim in dims:
+        points = make_points(args.points, dim, dist=args.dist,
+                             card=args.card)
+        for engine in engines:
+            try:
+                rate, sky_size = bench(engine, points, dim, card=args.card)
+            except SkylineException as exp:
+                print "{:>6} {:>10} skipped: {}".format(dim, engine, exp)
+                continue
+            print "{:>6} {:>10} {:>12.0f} {:>10}".format(dim, engine, rate,
+                                                         sky_size)
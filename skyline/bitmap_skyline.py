@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# bitmap_skyline.py: skyline engine for points whose coordinates are
+# all small non-negative integers (like the KDD count columns). Every
+# skyline point gets a bit, and for each value of each dimension we
+# keep the bits of the skyline points at or below that value, so a
+# dominance check is one AND per dimension instead of a scan
+
+
+# local imports
+from constants import REMOVE_DUPS, DISCRETE_CARDS
+from skyline import Skyline, SkyStore, SkylineException
+
+
+def iter_bits(bits):
+    """Yield the positions of the set bits in bits, lowest first"""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class BitmapStore(SkyStore):
+    """SkyStore that also keeps its points in per-value bitmaps
+
+    Each point is assigned a slot, and self.below[dim][val] is a
+    bitmap (a python int) of the slots of the points with data[dim] <=
+    val. self.used has the bits of all of the slots in use. Inserts
+    and deletes touch up to card bitmaps per dimension, but those are
+    rare next to dominance checks, which only take one bitmap per
+    dimension.
+
+    """
+
+    def __init__(self, cards, items=None):
+        SkyStore.__init__(self)
+        self.cards = list(cards)
+        self.reset_bits()
+        if items is not None:
+            self.replace(list(items))
+
+    def reset_bits(self):
+        self.slots = []
+        self.free = []
+        self.slot_of = {}
+        self.used = 0
+        self.below = [[0] * card for card in self.cards]
+
+    def check(self, data):
+        """Make sure that data fits in the bitmaps (this is only done on
+        insert, see BitmapSkyline.update_sky_for_point for lookups)
+
+        """
+        if len(data) != len(self.cards):
+            raise SkylineException("data points have unequal dimensions")
+        for dim in range(len(data)):
+            val = data[dim]
+            if (not isinstance(val, (int, long)) or val < 0 or
+                    val >= self.cards[dim]):
+                raise SkylineException("bitmap dimension {} only supports "
+                                       "integers from 0 to {}, not {}"
+                                       "".format(dim, self.cards[dim] - 1,
+                                                 val))
+
+    def set_bits(self, item):
+        self.check(item.data)
+        if len(self.free) > 0:
+            slot = self.free.pop()
+            self.slots[slot] = item
+        else:
+            slot = len(self.slots)
+            self.slots.append(item)
+        self.slot_of[id(item)] = slot
+        bit = 1 << slot
+        self.used |= bit
+        for dim in range(len(self.cards)):
+            row = self.below[dim]
+            for val in range(item.data[dim], self.cards[dim]):
+                row[val] |= bit
+
+    def clear_bits(self, item):
+        slot = self.slot_of.pop(id(item))
+        self.slots[slot] = None
+        self.free.append(slot)
+        mask = ~(1 << slot)
+        self.used &= mask
+        for dim in range(len(self.cards)):
+            row = self.below[dim]
+            for val in range(item.data[dim], self.cards[dim]):
+                row[val] &= mask
+
+    def dominators(self, data):
+        """Return the bitmap of the points <= data in every dimension"""
+        bits = self.used
+        for dim in range(len(data)):
+            bits &= self.below[dim][data[dim]]
+        return bits
+
+    def dominated(self, data):
+        """Return the bitmap of the points >= data in every dimension"""
+        bits = self.used
+        for dim in range(len(data)):
+            if data[dim] > 0:
+                bits &= ~self.below[dim][data[dim] - 1]
+        return bits
+
+    def points(self, bits):
+        return [self.slots[slot] for slot in iter_bits(bits)]
+
+    def put(self, item):
+        self.set_bits(item)
+        SkyStore.put(self, item)
+
+    def extend(self, items):
+        for item in items:
+            self.put(item)
+
+    def replace(self, items):
+        self.reset_bits()
+        for item in items:
+            self.set_bits(item)
+        SkyStore.replace(self, items)
+
+    def swap(self, old, new):
+        # same coordinates, so the bits stay as they are
+        slot = self.slot_of.pop(id(old))
+        self.slots[slot] = new
+        self.slot_of[id(new)] = slot
+        SkyStore.swap(self, old, new)
+
+    def remove_points(self, points):
+        """Remove the given points (matched by identity)"""
+        for point in points:
+            self.clear_bits(point)
+        SkyStore.remove_points(self, points)
+
+    def retain(self, keep):
+        removed = [item for item in self.items if not keep(item)]
+        self.remove_points(removed)
+        return removed
+
+    def drain(self):
+        self.reset_bits()
+        return SkyStore.drain(self)
+
+
+class BitmapSkyline(Skyline):
+    """Skyline that answers dominance checks with bitmaps
+
+    cards is the number of values of each dimension (the values of
+    dimension i go from 0 to cards[i] - 1), which defaults to
+    DISCRETE_CARDS
+
+    """
+
+    def __init__(self, skyline=None, non_sky=None, cards=None):
+        if cards is None:
+            cards = DISCRETE_CARDS
+        if cards is None:
+            raise SkylineException("the bitmap skyline engine needs the "
+                                   "cardinality of each dimension")
+        Skyline.__init__(self, skyline=skyline, non_sky=non_sky)
+        if skyline is None:
+            self.skyline = BitmapStore(cards)
+
+    def update_sky_for_point(self, point):
+        """Update the skyline for a new data point
+
+        Returns True if the point was added to the skyline
+
+        """
+        data = point.data
+        store = self.skyline
+        # a full check costs about as much as the lookup itself, so we
+        # only catch negative values (which would wrap around) here
+        # and let the lookup fail on anything else
+        if len(data) != len(store.cards) or min(data) < 0:
+            store.check(data)
+
+        # duplicates of a skyline point don't need a scan
+        absorbed = self.absorb_duplicate(point)
+        if absorbed is not None:
+            return absorbed
+
+        # anything <= us in every dimension dominates us, except for
+        # equal points, which are either absorbed above (REMOVE_DUPS)
+        # or incomparable
+        try:
+            bits = store.dominators(data)
+        except (IndexError, TypeError):
+            store.check(data)
+            raise
+        dominator = None
+        for slot in iter_bits(bits):
+            item = store.slots[slot]
+            if item.data != data:
+                dominator = item
+                break
+        if dominator is not None:
+            self.demote(point, dominator)
+            self.comparisons = len(data)
+            return False
+
+        # and we dominate anything >= us in every dimension
+        evicted = [item for item in store.points(store.dominated(data))
+                   if item.data != data or REMOVE_DUPS]
+        store.remove_points(evicted)
+        for item in evicted:
+            self.demote(item, point)
+        store.put(point)
+        self.comparisons = 2 * len(data)
+        return True
@@ -11,5 +11,45 @@ WORKER_REQUERIES = 30
 WORKER_MASTER_WAIT = 30
 SERVER_TIMEOUT = 5
 SERVER_REQUERIES = 5
+# longest that the master holds on to a worker's request for a step's
+# skyline before answering that it is not ready yet (long polling)
+LONG_POLL_WAIT = 60
+# how the worker compresses its uploads to the master (gzip, deflate,
+# or None). Responses are compressed with whatever the worker accepts
+COMPRESSION = 'gzip'
+# how the worker would like the skyline changes to go back and forth
+# with the master: json, or columns for the binary columnar format in
+# wire.py (which falls back to JSON if the master doesn't support it)
+WIRE_FORMAT = 'json'
 REMOVE_DUPS = True
-RECORD_ALL = False
+# move the skyline point that dominated the last point to the front of
+# the scan, so that runs of points with the same dominator are
+# rejected after a single comparison
+MOVE_TO_FRONT = True
+# approximate skylines: snap coordinates to powers of (1 + EPSILON),
+# so every exact skyline point is within a factor of (1 + EPSILON) of
+# a reported point (None for the exact skyline)
+EPSILON = None
+# only report the TOP_K skyline points that dominate the most other
+# points (None to report the whole skyline)
+TOP_K = None
+# subsets of the dimensions to also keep skylines over, like 0,1;0,2
+# or all for every subset (see skycube.py), and None for just the
+# full skyline
+SUBSPACES = None
+# number of values of each dimension when every dimension is a small
+# non-negative integer (dimension i goes from 0 to DISCRETE_CARDS[i] -
+# 1), which lets the bitmap engine do dominance checks with bitwise
+# ANDs (None if the data isn't like that)
+DISCRETE_CARDS = None
+# where to write skyline metrics (None turns them off). Histograms
+# and sizes are recorded for one point in every METRICS_SAMPLE and
+# written out every METRICS_INTERVAL seconds
+METRICS_FILE = None
+METRICS_SAMPLE = 64
+METRICS_INTERVAL = 10
+SKY_ENGINE = 'auto'
+# most skyline points the spill engine keeps in memory and where it
+# puts the spill file (None for the system temp directory)
+SPILL_BUDGET = 10000
+SPILL_DIR = None
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# engines.py: lookup table for the different skyline engines so that
+# the master and worker can pick one by name
+
+# non stdlib imports
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# local imports
+from constants import SKY_ENGINE, EPSILON, DISCRETE_CARDS, SPILL_BUDGET
+from bitmap_skyline import BitmapSkyline
+from index_skyline import IndexSkyline
+from skyline import Skyline, SkylineException, WindowCandidates
+from spill_skyline import SpillSkyline
+from staircase_skyline import StaircaseSkyline
+from vector_skyline import VectorSkyline
+
+
+ENGINES = {'bnl': Skyline, 'vector': VectorSkyline,
+           'staircase': StaircaseSkyline, 'kdtree': IndexSkyline,
+           'spill': SpillSkyline, 'bitmap': BitmapSkyline}
+VECTOR_MIN_DIMS = 4
+
+
+def parse_cards(spec):
+    """Return the number of values of each dimension from spec, like
+    2,10,10 (None if spec is None)
+
+    """
+    if spec is None:
+        return None
+    try:
+        cards = [int(card) for card in spec.split(",")]
+    except ValueError:
+        raise SkylineException("bad cardinalities {}".format(spec))
+    check_cards(cards)
+    return cards
+
+
+def check_cards(cards, dims=None):
+    """Make sure that cards gives a positive number of values for each
+    of the dims dimensions (if we know dims)
+
+    """
+    if any(card < 1 for card in cards):
+        raise SkylineException("every dimension needs at least one value, "
+                               "not {}".format(cards))
+    if dims is not None and len(cards) != dims:
+        raise SkylineException("{} cardinalities for {} dimensions"
+                               "".format(len(cards), dims))
+
+
+def choose_engine(dims, epsilon=None, cards=DISCRETE_CARDS):
+    """Pick the engine for the auto mode based on the dimensions of the
+    points (None if we don't know yet)
+
+    """
+    if dims == 2:
+        return 'staircase'
+    # declared small integer dimensions are best served by bitmaps
+    # (see perf-analysis/bench_engines.py --dist discrete), except in
+    # 2-D where the staircase still wins. Snapping to the epsilon grid
+    # turns the coordinates into floats, so approximate skylines can't
+    # use them
+    if cards is not None and dims == len(cards) and epsilon is None:
+        return 'bitmap'
+    # from 4 dimensions up, the BNL scan falls apart on anticorrelated
+    # data. The vector engine is the fastest up to a few thousand
+    # skyline points at any number of dimensions, and the k-d tree only
+    # pulls ahead (by about 2x) once the skyline has tens of thousands
+    # of points (see perf-analysis/bench_engines.py --dist
+    # anticorrelated with --points 1000 to 30000). We don't know how
+    # big the skyline will get, so the k-d tree is only the fallback
+    # when we don't have numpy
+    if dims is not None and dims >= VECTOR_MIN_DIMS:
+        if np is None:
+            return 'kdtree'
+        return 'vector'
+    return 'bnl'
+
+
+def make_skyline(engine=SKY_ENGINE, dims=None, win_size=None, metrics=None,
+                 epsilon=EPSILON, cards=DISCRETE_CARDS,
+                 budget=SPILL_BUDGET):
+    """Create an empty skyline using the engine with the given name
+
+    If engine is auto, then the engine is chosen from the number of
+    dimensions in the data. If win_size is given, then the skyline is
+    for a sliding window of win_size steps: the non-skyline points are
+    kept in a WindowCandidates store, which drops points that can never
+    come back, and all points are bucketed by step for cheap expiry.
+    The skyline records into metrics (a Metrics object) if given, and
+    is approximate (see skyline.snap_point) if epsilon is given. cards
+    is the number of values of each dimension for the bitmap engine
+    (see bitmap_skyline.py), if the data has small integer dimensions,
+    and budget is the most skyline points that the spill engine keeps
+    in memory
+
+    """
+    if cards is not None:
+        check_cards(cards, dims)
+    if engine == 'auto':
+        engine = choose_engine(dims, epsilon=epsilon, cards=cards)
+    if engine not in ENGINES:
+        raise SkylineException("unknown skyline engine {}".format(engine))
+    kwargs = {}
+    if engine == 'bitmap':
+        if epsilon is not None:
+            raise SkylineException("the bitmap skyline engine needs integer "
+                                   "coordinates, so it can't be approximate")
+        kwargs['cards'] = cards
+    if engine == 'spill':
+        kwargs['budget'] = budget
+    if win_size is not None:
+        kwargs['non_sky'] = WindowCandidates()
+    sky = ENGINES[engine](**kwargs)
+    if win_size is not None:
+        sky.track_steps(win_size)
+    sky.metrics = metrics
+    sky.epsilon = epsilon
+    return sky
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# index_skyline.py: skyline engine backed by a k-d tree. Checking if a
+# point is dominated and finding the points it dominates are both
+# region queries (everything below the point and everything above the
+# point), so the tree lets us skip whole parts of a large skyline
+
+
+# local imports
+from constants import REMOVE_DUPS
+from skyline import Skyline, SkyStore, SkylineException
+
+# constants
+LEAF_SIZE = 16
+
+
+class KDNode():
+    """Node in the k-d tree
+
+    Leaves keep a list of (coords, point) entries. Inner nodes split on
+    dimension dim, with coords[dim] < split going left. Every node
+    keeps the bounding box (lo, hi) of the points below it. Deletes
+    don't shrink the box, which only makes it conservative.
+
+    """
+
+    def __init__(self, entries=None):
+        self.entries = []
+        self.dim, self.split = None, None
+        self.left, self.right = None, None
+        self.lo, self.hi = None, None
+        if entries is not None:
+            for entry in entries:
+                self.add_to_box(entry[0])
+            self.entries = entries
+
+    def is_leaf(self):
+        return self.entries is not None
+
+    def add_to_box(self, coords):
+        if self.lo is None:
+            self.lo, self.hi = list(coords), list(coords)
+            return
+        for idx in range(len(coords)):
+            if coords[idx] < self.lo[idx]:
+                self.lo[idx] = coords[idx]
+            elif coords[idx] > self.hi[idx]:
+                self.hi[idx] = coords[idx]
+
+    def split_leaf(self):
+        """Split a full leaf on its widest dimension at the median"""
+        spreads = [self.hi[idx] - self.lo[idx]
+                   for idx in range(len(self.lo))]
+        dim = spreads.index(max(spreads))
+        values = sorted(entry[0][dim] for entry in self.entries)
+        split = values[len(values) // 2]
+        left = [entry for entry in self.entries if entry[0][dim] < split]
+        right = [entry for entry in self.entries if entry[0][dim] >= split]
+        # if everything lands on one side (lots of equal values), then
+        # keep the leaf as it is
+        if len(left) == 0 or len(right) == 0:
+            return
+        self.dim, self.split = dim, split
+        self.left, self.right = KDNode(left), KDNode(right)
+        self.entries = None
+
+
+class KDTree():
+    """k-d tree over skyline points that supports inserts, deletes and
+    the two dominance region queries
+
+    """
+
+    def __init__(self, entries=None):
+        self.root = KDNode()
+        self.size = 0
+        self.deleted = 0
+        if entries is not None:
+            self.root = self.build(list(entries))
+            self.size = len(entries)
+
+    def build(self, entries):
+        if len(entries) <= LEAF_SIZE:
+            return KDNode(entries)
+        node = KDNode(entries)
+        node.split_leaf()
+        if node.is_leaf():
+            return node
+        node.left = self.build(node.left.entries)
+        node.right = self.build(node.right.entries)
+        return node
+
+    def insert(self, coords, point):
+        node = self.root
+        while True:
+            node.add_to_box(coords)
+            if node.is_leaf():
+                break
+            if coords[node.dim] < node.split:
+                node = node.left
+            else:
+                node = node.right
+        node.entries.append((coords, point))
+        if len(node.entries) > LEAF_SIZE:
+            node.split_leaf()
+        self.size += 1
+
+    def delete(self, coords, point):
+        node = self.root
+        while not node.is_leaf():
+            if coords[node.dim] < node.split:
+                node = node.left
+            else:
+                node = node.right
+        for idx in range(len(node.entries)):
+            if node.entries[idx][1] is point:
+                del node.entries[idx]
+                self.size -= 1
+                self.deleted += 1
+                return True
+        return False
+
+    def below(self, coords):
+        """Yield (coords, point) for every point <= coords in all
+        dimensions (the points that could dominate coords)
+
+        """
+        dims = range(len(coords))
+        stack = [self.root]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.lo is None:
+                continue
+            lo = node.lo
+            if any(lo[idx] > coords[idx] for idx in dims):
+                continue
+            if not node.is_leaf():
+                stack.append(node.right)
+                stack.append(node.left)
+                continue
+            for entry in node.entries:
+                other = entry[0]
+                if all(other[idx] <= coords[idx] for idx in dims):
+                    yield entry
+
+    def above(self, coords):
+        """Yield (coords, point) for every point >= coords in all
+        dimensions (the points that coords could dominate)
+
+        """
+        dims = range(len(coords))
+        stack = [self.root]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.lo is None:
+                continue
+            hi = node.hi
+            if any(hi[idx] < coords[idx] for idx in dims):
+                continue
+            if not node.is_leaf():
+                stack.append(node.right)
+                stack.append(node.left)
+                continue
+            for entry in node.entries:
+                other = entry[0]
+                if all(other[idx] >= coords[idx] for idx in dims):
+                    yield entry
+
+
+class IndexStore(SkyStore):
+    """SkyStore that also indexes its points in a k-d tree"""
+
+    def __init__(self, items=None):
+        SkyStore.__init__(self)
+        self.tree = KDTree()
+        if items is not None:
+            self.replace(list(items))
+
+    def put(self, item):
+        self.tree.insert(item.data, item)
+        SkyStore.put(self, item)
+
+    def extend(self, items):
+        for item in items:
+            self.put(item)
+
+    def replace(self, items):
+        self.tree = KDTree([(item.data, item) for item in items])
+        SkyStore.replace(self, items)
+
+    def swap(self, old, new):
+        self.tree.delete(old.data, old)
+        self.tree.insert(new.data, new)
+        SkyStore.swap(self, old, new)
+
+    def remove_points(self, points):
+        """Remove the given points (matched by identity)"""
+        if len(points) == 0:
+            return
+        for point in points:
+            self.tree.delete(point.data, point)
+        SkyStore.remove_points(self, points)
+        # deletes leave empty leaves and loose bounding boxes behind,
+        # so rebuild once we have deleted more than we are holding
+        if self.tree.deleted > len(self.items):
+            self.replace(self.items)
+
+    def retain(self, keep):
+        kept, removed = [], []
+        for item in self.items:
+            if keep(item):
+                kept.append(item)
+            else:
+                removed.append(item)
+        # rebuilding also tightens the bounding boxes after the deletes
+        if len(removed) > 0:
+            self.replace(kept)
+        return removed
+
+    def drain(self):
+        self.tree = KDTree()
+        return SkyStore.drain(self)
+
+
+class IndexSkyline(Skyline):
+    """Skyline that answers dominance checks with region queries against
+    a k-d tree instead of scanning every skyline point
+
+    """
+
+    def __init__(self, skyline=None, non_sky=None):
+        Skyline.__init__(self, skyline=skyline, non_sky=non_sky)
+        if skyline is None:
+            self.skyline = IndexStore()
+
+    def update_sky_for_point(self, point):
+        """Update the skyline for a new data point
+
+        Returns True if the point was added to the skyline
+
+        """
+        coords = point.data
+        sky_points = self.skyline.items
+        if len(sky_points) > 0 and len(coords) != len(sky_points[0].data):
+            raise SkylineException("data points have unequal dimensions")
+
+        # duplicates of a skyline point don't need a scan
+        absorbed = self.absorb_duplicate(point)
+        if absorbed is not None:
+            return absorbed
+
+        # look for a point that dominates us. Equal points fall back
+        # on the REMOVE_DUPS tie-break in check_dominated
+        comparisons = 0
+        is_dominated = False
+        for other, item in self.skyline.tree.below(coords):
+            comparisons += 1
+            if other != coords:
+                is_dominated = True
+            elif REMOVE_DUPS:
+                is_dominated = point.step <= item.step
+            if is_dominated:
+                dominator = item
+                break
+
+        if is_dominated:
+            self.demote(point, dominator)
+            self.comparisons = comparisons
+            return False
+
+        # now evict everything that we dominate
+        evicted = []
+        for other, item in self.skyline.tree.above(coords):
+            comparisons += 1
+            if other != coords or REMOVE_DUPS:
+                evicted.append(item)
+        self.skyline.remove_points(evicted)
+        for item in evicted:
+            self.demote(item, point)
+        self.skyline.put(point)
+
+        self.comparisons = comparisons
+        return True
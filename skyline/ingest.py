@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# ingest.py: read the worker's input a block of lines at a time and
+# turn each block into points in bulk, instead of splitting and
+# converting one line at a time in python
+
+
+# stdlib
+import gc
+import mmap
+import operator
+import os
+import Queue
+import sys
+import threading
+
+# non stdlib imports
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# local imports
+from skyline import SkyPoint, SkylineException
+
+# constants
+# about how many bytes of input we read at a time
+READ_BLOCK = 1 << 20
+# bytes that we look for in memory mapped input
+NEWLINE, RETURN, COMMA, ZERO = [ord(char) for char in "\n\r,0"]
+# longest integer that we parse straight from the digits (more digits
+# could overflow an int64)
+MAX_DIGITS = 18
+# how many parsed blocks the read ahead thread can get ahead by
+READ_AHEAD = 4
+
+
+def paused_gc(build, *args):
+    """Return build(*args), with the cycle collector paused
+
+    Nothing that we build from a block can be part of a cycle, so there
+    is no point in the cycle collector going over the block (and
+    everything else) every few hundred points while we build it
+
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return build(*args)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def read_blocks(inputf, block_size=READ_BLOCK):
+    """Yield lists of whole lines (without their line endings) from
+    about block_size bytes of inputf at a time
+
+    """
+    while True:
+        block = inputf.read(block_size)
+        if len(block) == 0:
+            return
+        # finish the line that the block ends in
+        if not block.endswith("\n"):
+            block += inputf.readline()
+        yield block.splitlines()
+
+
+class ColumnParser():
+    """Parse blocks of CSV lines into points in bulk
+
+    columns are the CSV columns to use as the dimensions, in order, and
+    flip maps a dimension (an index into columns) to the value m that
+    it is subtracted from, so that m - value is minimized (the skyline
+    keeps the smallest values, and we want the largest counts). The
+    label column (-1 for the last one) is kept in extra as the class,
+    like proc_dur_count does. If given, fields is called with the data
+    of a point and returns more (name, value) pairs for its extra, like
+    the dur and count fields of proc_dur_count. Every point is in step
+    0, since the KDD data has no time.
+
+    Each step runs over the whole block in C (split, itemgetter, zip,
+    and numpy's string parsing), so the only python code that runs
+    per line is SkyPoint.__init__. We also only split each line up to
+    the last column that we need. Without numpy, the columns are
+    converted with map(int, ...), which is a bit slower.
+
+    """
+
+    def __init__(self, columns, flip=None, label=-1, fields=None):
+        if len(columns) == 0:
+            raise SkylineException("need at least one column to parse")
+        self.columns = list(columns)
+        if flip is None:
+            flip = {}
+        self.flip = flip
+        self.label = label
+        self.fields = fields
+        # the last column that we need, not counting a label at the end
+        self.last = max(self.columns)
+        if label is not None:
+            self.last = max(self.last, label)
+        self.splitter = operator.methodcaller('split', ',', self.last + 1)
+
+    def parse(self, lines):
+        """Return the points for a list of lines"""
+        return paused_gc(self.parse_rows, map(self.splitter, lines))
+
+    def parse_rows(self, rows):
+        """Return the points for a list of split lines"""
+        if len(rows) == 0:
+            return []
+        values = [self.column(rows, dim) for dim in range(len(self.columns))]
+        labels = None
+        if self.label is not None:
+            labels = self.labels(rows)
+        return self.make_points(values, labels)
+
+    def make_points(self, values, labels):
+        """Return the points for the (flipped) values of each dimension
+        and the labels (None if we don't keep them)
+
+        """
+        data = zip(*values)
+        if labels is None and self.fields is None:
+            extras = [None] * len(data)
+        elif self.fields is None:
+            # there are only a few classes, so the points share extras
+            extras = dict((label, (('class', label),))
+                          for label in set(labels))
+            extras = map(extras.__getitem__, labels)
+        else:
+            # the fields only depend on the data, so points with the
+            # same data and label share extras too
+            if labels is None:
+                labels = [None] * len(data)
+            keys = zip(labels, data)
+            extras = dict((key, self.extra(*key)) for key in set(keys))
+            extras = map(extras.__getitem__, keys)
+        return map(SkyPoint, [0] * len(data), data, extras)
+
+    def extra(self, label, data):
+        """Return the extra of a point with this label and data"""
+        pairs = list(self.fields(data))
+        if label is not None:
+            pairs.append(('class', label))
+        return tuple(sorted(pairs))
+
+    def flipped(self, dim, values):
+        """Return the numpy array of values of dimension dim, flipped if
+        we flip that dimension
+
+        """
+        if dim in self.flip:
+            return self.flip[dim] - values
+        return values
+
+    def column(self, rows, dim):
+        """Return the values of a dimension for the split rows"""
+        values = map(operator.itemgetter(self.columns[dim]), rows)
+        # numpy would clamp values that don't fit in an int64
+        if np is not None and max(map(len, values)) <= MAX_DIGITS:
+            values = np.fromstring(",".join(values), dtype=np.int64, sep=",")
+            # fromstring stops at the first value it can't parse
+            if len(values) != len(rows):
+                raise SkylineException("column {} has values that are not "
+                                       "integers".format(self.columns[dim]))
+            return self.flipped(dim, values).tolist()
+        values = map(int, values)
+        if dim in self.flip:
+            top = self.flip[dim]
+            values = [top - value for value in values]
+        return values
+
+    def labels(self, rows):
+        """Return the label of each of the split rows"""
+        if self.label >= 0:
+            return map(operator.itemgetter(self.label), rows)
+        # the last column is at the end of whatever we didn't split
+        rests = map(operator.itemgetter(-1), rows)
+        return map(operator.itemgetter(2),
+                   map(operator.methodcaller('rpartition', ','), rests))
+
+
+class MappedReader():
+    """Read the points of a CSV file straight out of a memory map
+
+    With numpy, each block of the map is viewed as an array of bytes
+    without copying it. We find the line and field boundaries with
+    vectorized searches for newlines and commas, add up the integer
+    columns from their digits where they are, and only the distinct
+    labels ever become python strings. A block that doesn't look like
+    we expect (a column with something other than digits, or too few
+    columns) goes through parser.parse instead, as does everything
+    without numpy.
+
+    """
+
+    def __init__(self, inputf, parser, block_size=READ_BLOCK):
+        self.inputf = inputf
+        self.parser = parser
+        self.block_size = block_size
+
+    def blocks(self):
+        """Yield the points of the file, a block of lines at a time"""
+        size = os.fstat(self.inputf.fileno()).st_size
+        if size == 0:
+            return
+        mapped = mmap.mmap(self.inputf.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            while start < size:
+                # end the block after the line that it ends in
+                end = mapped.find("\n", min(start + self.block_size,
+                                            size - 1))
+                if end < 0:
+                    end = size
+                else:
+                    end += 1
+                yield paused_gc(self.parse_block, mapped, start, end)
+                start = end
+        finally:
+            mapped.close()
+
+    def parse_block(self, mapped, start, end):
+        """Return the points for the lines from start to end of the map"""
+        points = None
+        if np is not None:
+            points = self.parse_mapped(np.frombuffer(mapped, dtype=np.uint8,
+                                                     count=end - start,
+                                                     offset=start))
+        if points is None:
+            points = self.parser.parse(mapped[start:end].splitlines())
+        return points
+
+    def parse_mapped(self, buf):
+        """Return the points for the lines in the byte array buf, or None
+        if we can't parse them here
+
+        """
+        parser = self.parser
+        newlines = np.flatnonzero(buf == NEWLINE)
+        # the last line of the file might not have a newline
+        if len(newlines) == 0 or newlines[-1] != len(buf) - 1:
+            newlines = np.append(newlines, len(buf))
+        starts = np.concatenate(([0], newlines[:-1] + 1))
+        ends = newlines - ((buf[newlines - 1] == RETURN) &
+                           (newlines > starts))
+        commas = np.flatnonzero(buf == COMMA)
+        # the commas of line i are commas[first[i]:after[i]]
+        first = np.searchsorted(commas, starts)
+        after = np.searchsorted(commas, ends)
+        num_commas = after - first
+        if num_commas.min() < parser.last:
+            return None
+
+        values = []
+        for dim in range(len(parser.columns)):
+            col_starts, col_ends = self.field(parser.columns[dim], starts,
+                                              ends, commas, first,
+                                              num_commas)
+            column = self.parse_ints(buf, col_starts, col_ends)
+            if column is None:
+                return None
+            values.append(parser.flipped(dim, column).tolist())
+        labels = None
+        if parser.label is not None:
+            if parser.label >= 0:
+                label_starts, label_ends = self.field(parser.label, starts,
+                                                      ends, commas, first,
+                                                      num_commas)
+            else:
+                # the last column starts after the last comma
+                label_starts = np.where(num_commas > 0,
+                                        commas[np.maximum(after - 1, 0)] + 1,
+                                        starts)
+                label_ends = ends
+            labels = self.parse_labels(buf, label_starts, label_ends)
+        return parser.make_points(values, labels)
+
+    def field(self, col, starts, ends, commas, first, num_commas):
+        """Return where column col starts and ends on each line"""
+        if col == 0:
+            col_starts = starts
+        else:
+            col_starts = commas[first + col - 1] + 1
+        if len(commas) == 0:
+            return col_starts, ends
+        next_comma = commas[np.minimum(first + col, len(commas) - 1)]
+        return col_starts, np.where(num_commas > col, next_comma, ends)
+
+    def parse_ints(self, buf, col_starts, col_ends):
+        """Return the non-negative integers written from col_starts to
+        col_ends in buf, or None if they aren't all digits
+
+        """
+        lengths = col_ends - col_starts
+        width = lengths.max()
+        if lengths.min() < 1 or width > MAX_DIGITS:
+            return None
+        # line the digits up on the right, with zeros on the left
+        idx = col_ends[:, None] - width + np.arange(width)
+        in_col = idx >= col_starts[:, None]
+        digits = buf[np.where(in_col, idx, 0)].astype(np.int64) - ZERO
+        if np.any(in_col & ((digits < 0) | (digits > 9))):
+            return None
+        digits[~in_col] = 0
+        powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+        return digits.dot(powers)
+
+    def parse_labels(self, buf, col_starts, col_ends):
+        """Return the strings from col_starts to col_ends in buf"""
+        width = max(1, (col_ends - col_starts).max())
+        idx = col_starts[:, None] + np.arange(width)
+        in_col = idx < col_ends[:, None]
+        chars = np.where(in_col, buf[np.where(in_col, idx, 0)], 0)
+        # fixed width strings drop the zeros at the end, and we only
+        # make python strings for the distinct labels
+        keys = np.ascontiguousarray(chars.astype(np.uint8))
+        keys = keys.view('S{}'.format(width)).ravel()
+        distinct, inverse = np.unique(keys, return_inverse=True)
+        return map(distinct.tolist().__getitem__, inverse.tolist())
+
+
+class ReadAhead():
+    """Read and parse blocks in a background thread while the caller
+    works on the ones before them
+
+    blocks is any iterable of blocks (like Worker.read_points), which
+    the thread runs up to depth blocks ahead of the caller through a
+    bounded queue, so a slow caller holds back the reading instead of
+    letting it fill up memory. We count how often each side had to
+    wait on the other: if the caller keeps finding the queue empty,
+    then reading and parsing is the bottleneck, and if the thread
+    keeps finding it full, then the caller is.
+
+    Exceptions from blocks are raised in the caller when it gets to
+    them.
+
+    """
+
+    def __init__(self, blocks, depth=READ_AHEAD):
+        self.queue = Queue.Queue(maxsize=depth)
+        self.depth = depth
+        self.stopped = False
+        # times the reader found the queue full and the caller found it
+        # empty, and blocks handed to the caller
+        self.full_waits = 0
+        self.empty_waits = 0
+        self.consumed = 0
+        self.thread = threading.Thread(target=self.produce, args=(blocks,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def produce(self, blocks):
+        try:
+            for block in blocks:
+                if self.queue.full():
+                    self.full_waits += 1
+                self.queue.put((block, None))
+                if self.stopped:
+                    return
+        except Exception:
+            self.queue.put((None, sys.exc_info()))
+            return
+        self.queue.put((None, None))
+
+    def __iter__(self):
+        while True:
+            if self.queue.empty():
+                self.empty_waits += 1
+            block, error = self.queue.get()
+            if error is not None:
+                raise error[0], error[1], error[2]
+            if block is None:
+                return
+            self.consumed += 1
+            yield block
+
+    def occupancy(self):
+        """Return how many parsed blocks are waiting for the caller"""
+        return self.queue.qsize()
+
+    def stats(self):
+        return {'depth': self.depth, 'consumed': self.consumed,
+                'empty_waits': self.empty_waits,
+                'full_waits': self.full_waits}
+
+    def close(self):
+        """Stop the reader, even if the caller didn't get to the end"""
+        self.stopped = True
+        # keep making room for whatever the reader is stuck putting
+        while self.thread.is_alive():
+            try:
+                while True:
+                    self.queue.get_nowait()
+            except Queue.Empty:
+                pass
+            self.thread.join(0.1)
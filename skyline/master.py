@@ -20,7 +20,6 @@
 import argparse
 import json
 import logging
-import Queue
 import sys
 import time
 import threading
@@ -36,16 +35,29 @@ app = Flask(__name__)
 
 
 # local imports
-from constants import MASTER_TIMEOUT_TO_END, MASTER_WAIT_TIME
-from skyline import Skyline
+from constants import MASTER_TIMEOUT_TO_END, MASTER_WAIT_TIME, SKY_ENGINE
+from constants import METRICS_FILE, EPSILON, TOP_K, SUBSPACES
+from constants import LONG_POLL_WAIT, DISCRETE_CARDS
+from engines import make_skyline, parse_cards
+from metrics import Metrics
+from skycube import subspace_key
+from skyline import SkyStore, SkylineException, points_to_json
+from wire import COMPRESS_MIN, CONTENT_TYPES, COLUMNS_TYPE, JSON_TYPE
+from wire import accepted_encoding, compress, decompress, decode_message
+from wire import encode_message
 
 
 class Master():
     def __init__(self, outfile, start_time, step_size, win_size,
-                 num_workers=2, workers=None):
+                 num_workers=2, workers=None, engine=SKY_ENGINE,
+                 metrics_file=METRICS_FILE, epsilon=EPSILON, top_k=TOP_K,
+                 subspaces=SUBSPACES, cards=DISCRETE_CARDS):
         logger.info("Created master class")
         self.outfile = outfile
         self.num_workers = num_workers
+        # workers that are done, but still count for the step that
+        # they sent their last data for
+        self.leaving = 0
         self.non_skyline = []
         self.sky_received = 0
         self.unprocessed_sky = []
@@ -65,11 +77,27 @@ class Master():
 
         self.status_lock = threading.Lock()
         self.data_lock = threading.Lock()
-
-        self.sky = Skyline()
+        # notified (with status_lock held) whenever a worker's data
+        # comes in or a step's skyline is done, so that neither the run
+        # loop nor the workers have to poll
+        self.changed = threading.Condition(self.status_lock)
+
+        self.engine = engine
+        self.epsilon = epsilon
+        self.top_k = top_k
+        self.subspaces = subspaces
+        self.cards = cards
+        self.metrics = None
+        if metrics_file is not None:
+            self.metrics = Metrics.open(metrics_file, name='master')
+        self.sky = make_skyline(engine, metrics=self.metrics, cards=cards)
         self.skyline = []
         self.skylines = {}
         self.skyline_changes = {}
+        # the global skyline of each subspace, and each worker's
+        # skyline of each subspace
+        self.cube_skys = {}
+        self.cube_skylines = {}
 
     def process_skyline(self):
         """Script to process the skyline for each new data point
@@ -79,79 +107,48 @@ class Master():
         2) update the global skyline from the individuals
 
         """
-        work_seen = {}
-        global_seen = {}
         try:
-            # update each local skyline
-            for sky in self.unprocessed_sky:
-                worker = sky['worker_id']
-                added, removed = sky['added'], sky['removed']
-                work_seen[worker] = {}
-
-                logger.debug("starting to process: {} {} {}"
-                             "".format(worker, added, removed))
-                # add and remove the entries
-                if worker not in self.skylines:
-                    self.skylines[worker] = Queue.Queue()
-
-                # remove the entries we don't need
-                # remove logger.debug("here 1")
-                to_see = self.skylines[worker].qsize()
-                for idx in range(to_see):
-                    # remove logger.debug("removing")
-                    item = self.skylines[worker].get_nowait()
-                    if item in removed:
-                        logger.debug("{} in removed".format(item))
-                        continue
-                    self.skylines[worker].put(item)
-                    key = tuple(item['data'] + [item['step']])
-                    work_seen[worker][key] = item
-                    global_seen[key] = item
-
-                # and add the new entries
-                # remove logger.debug("here 2")
-                for item in added:
-                    # remove logger.debug("adding")
-                    self.skylines[worker].put(item)
-                    key = tuple(item['data'] + [item['step']])
-                    work_seen[worker][key] = item
-                    global_seen[key] = item
-
-            logger.debug("skylines: {}".format(work_seen))
-            # self.step = item['step']
-            # remove logger.debug("here 3")
-            # now update the global skyline based on the items
-            self.sky = Skyline()
-            for key in global_seen:
-                # remove logger.debug("updating point {}".format(item))
-                item = global_seen[key]
-                self.sky.update_sky_for_point(item)
-
-            # snapshot the global skyline
-            skys = {}
-            self.skyline = []
-            to_see = self.sky.skyline.qsize()
-            for x in range(to_see):
-                item = self.sky.skyline.get_nowait()
-                key = tuple(item['data'] + [item['step']])
-                skys[key] = item
-                self.sky.skyline.put(item)
-                # remove logger.debug("skyline point {}".format(item))
-                self.skyline.append(item)
-            new_keys = set(skys.keys())
-
+            self.sky, changes = self.merge_skylines(
+                self.skylines, [(sky['worker_id'], sky['added'],
+                                 sky['removed'])
+                                for sky in self.unprocessed_sky],
+                metrics=self.metrics)
+            if self.metrics is not None:
+                self.metrics.incr('rounds')
+                self.metrics.sizes(self.sky)
+                self.metrics.maybe_export()
+
+            # snapshot the global skyline (points hash on their data
+            # and step)
+            self.skyline = self.sky.get_sky_as_list()
             logger.debug("Global skyline is: {}".format(self.skyline))
-            # return the difference to each worker
-            for worker in work_seen:
-                old_keys = set(work_seen[worker].keys())
-                added = new_keys - old_keys
-                removed = old_keys - new_keys
-                added = map(lambda x: skys[x], added)
-                removed = map(lambda x: work_seen[worker][x], removed)
+            for worker in changes:
+                added, removed = changes[worker]
                 update = {'step': self.step, 'added': added,
                           'removed': removed, 'worker_id': worker}
                 self.skyline_changes[worker] = update
-                logger.debug("skyline changes {}".format(update))
+
+            # and the same for every subspace skyline the workers sent
+            cube_keys = set()
+            for sky in self.unprocessed_sky:
+                cube_keys.update(sky.get('cube', {}))
+            for key in cube_keys:
+                if key not in self.cube_skylines:
+                    self.cube_skylines[key] = {}
+                updates = [(sky['worker_id'], sky['cube'][key]['added'],
+                            sky['cube'][key]['removed'])
+                           for sky in self.unprocessed_sky
+                           if key in sky.get('cube', {})]
+                self.cube_skys[key], changes = self.merge_skylines(
+                    self.cube_skylines[key], updates)
+                for worker in changes:
+                    added, removed = changes[worker]
+                    update = self.skyline_changes[worker]
+                    update.setdefault('cube', {})[key] = {'added': added,
+                                                          'removed': removed}
+            for worker in self.skyline_changes:
+                logger.debug("skyline changes {}"
+                             "".format(self.skyline_changes[worker]))
 
             self.unprocessed_sky = []
             self.recv_workers = {}
@@ -164,9 +161,119 @@ class Master():
             # traceback.print_exc()
             logger.exception("problem in processing skyline")
 
+    def merge_skylines(self, skylines, updates, metrics=None):
+        """Apply each worker's changes to its skyline and compute the
+        global skyline from them
+
+        skylines maps worker ids to the SkyStore of that worker's
+        skyline, and updates is a list of (worker id, added points,
+        removed points). Returns the global skyline and a dict from
+        worker id to the (added, removed) points that bring that
+        worker's skyline to the global one
+
+        """
+        work_seen = {}
+        global_seen = []
+        # update each local skyline
+        for worker, added, removed in updates:
+            removed = set(removed)
+            work_seen[worker] = set()
+
+            logger.debug("starting to process: {} {} {}"
+                         "".format(worker, added, removed))
+            # add and remove the entries
+            if worker not in skylines:
+                skylines[worker] = SkyStore()
+
+            # remove the entries we don't need
+            skylines[worker].retain(lambda item: item not in removed)
+            work_seen[worker].update(skylines[worker])
+
+            # and add the new entries
+            for item in added:
+                skylines[worker].put(item)
+                work_seen[worker].add(item)
+            # copy the points, since duplicates from different workers
+            # (even with the same step) are folded together in the
+            # global skyline and that changes their counts
+            global_seen.extend([point.copy() for point in work_seen[worker]])
+
+        logger.debug("skylines: {}".format(work_seen))
+        # now update the global skyline based on the items
+        dims = None
+        if len(global_seen) > 0:
+            dims = len(global_seen[0].data)
+        sky = make_skyline(self.engine, dims=dims, metrics=metrics,
+                           epsilon=self.epsilon, cards=self.cards)
+        sky.update_sky_for_points(global_seen)
+
+        # return the difference to each worker
+        new_keys = set(sky.get_sky_as_list())
+        changes = {}
+        for worker in work_seen:
+            old_keys = work_seen[worker]
+            added = list(new_keys - old_keys)
+            removed = list(old_keys - new_keys)
+            changes[worker] = (added, removed)
+
+            # the worker applies these changes before its next upload,
+            # so do the same to our copy of its skyline. Otherwise the
+            # points we removed stay here and come back once the points
+            # that dominated them expire (see Worker.sync_skyline)
+            to_remove = set(point.data for point in removed)
+            skylines[worker].retain(lambda item: item.data not in to_remove)
+            for point in added:
+                point = point.copy()
+                point.count, point.dominates = 0, 0
+                skylines[worker].put(point)
+        return sky, changes
+
+    def subspace_skyline(self, key):
+        """Return the latest global skyline of the subspace with the
+        given key (None for the full space), or None if we don't have
+        that subspace
+
+        """
+        if key is None:
+            sky = self.sky
+        elif key in self.cube_skys:
+            sky = self.cube_skys[key]
+        else:
+            return None
+        if self.top_k is not None:
+            return sky.representatives(self.top_k)
+        return sky.get_sky_as_list()
+
+    def wait_for_step(self, step, worker_id, timeout):
+        """Wait for up to timeout seconds until the changes for step
+        are ready for worker_id (the caller has to hold status_lock)
+
+        We only wait on steps that the worker has already sent us its
+        data for, since the others won't be done until it does
+
+        """
+        deadline = time.time() + timeout
+        while self.is_running:
+            pending = (self.step - 1 < step and
+                       worker_id in self.recv_workers)
+            if not self.is_computing and not pending:
+                return
+            left = deadline - time.time()
+            if left <= 0:
+                return
+            self.changed.wait(left)
+
     def write_out_skyline(self):
         logger.info("Writing out skyline")
-        entry = {'step': self.step - 1, 'data': self.skyline}
+        # in top k mode, we still compute (and sync with the workers)
+        # the skyline of their representatives, but only write out the
+        # top k of it
+        skyline = self.subspace_skyline(None)
+        entry = {'step': self.step - 1, 'data': points_to_json(skyline)}
+        if len(self.cube_skys) > 0:
+            entry['cube'] = dict((key,
+                                  points_to_json(self.subspace_skyline(key)))
+                                 for key in self.cube_skys)
         self.output.write(json.dumps(entry) + "\n")
 
     def run_loop(self):
@@ -212,9 +319,9 @@ class Master():
                         keep_running = False
                         continue
 
-                    self.status_lock.release()
                     logger.debug("waiting for new data")
-                    time.sleep(MASTER_WAIT_TIME)
+                    self.changed.wait(MASTER_WAIT_TIME)
+                    self.status_lock.release()
                     continue
 
                 # check how many workers have given us the skyline for
@@ -241,6 +348,9 @@ class Master():
                     self.status_lock.acquire()
                     self.is_computing = False
                     self.is_waiting = True
+                    self.num_workers -= self.leaving
+                    self.leaving = 0
+                    self.changed.notify_all()
                     self.status_lock.release()
                     continue
                 else:
@@ -261,9 +371,14 @@ class Master():
             # self.status_lock.release()
             # traceback.print_exc()
             logger.exception("Encountered problem in backend")
+        self.status_lock.acquire()
         self.is_running = False
+        self.changed.notify_all()
+        self.status_lock.release()
         # when we get here, we are done!
         self.output.close()
+        if self.metrics is not None:
+            self.metrics.close()
         logger.info("Ending run loop")
 
 
@@ -283,6 +398,65 @@ def locked_data(error):
     return flask.make_response(error_json, 423)
 
 
+@app.after_request
+def compress_response(response):
+    """Compress big responses for clients that accept it"""
+    if (response.status_code != 200 or response.direct_passthrough or
+            'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN:
+        return response
+    encoding = accepted_encoding(flask.request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def request_message():
+    """Return the message in the body of the request (None if there
+    isn't one), which may have been compressed with gzip or deflate
+
+    The message is JSON or in the columnar format, depending on the
+    Content-Type (see wire.py), and its lists of points come back as
+    SkyPoints
+
+    """
+    body = flask.request.get_data()
+    encoding = flask.request.headers.get('Content-Encoding')
+    if encoding is not None:
+        try:
+            body = decompress(body, encoding)
+        except SkylineException:
+            logger.exception("could not decompress request")
+            flask.abort(400)
+    if len(body) == 0:
+        return None
+    try:
+        return decode_message(body, flask.request.headers.get('Content-Type'))
+    except SkylineException:
+        logger.exception("could not decode request")
+        flask.abort(400)
+
+
+def message_response(message):
+    """Return a response with message, in the columnar format if the
+    client would rather have it, and in JSON otherwise
+
+    """
+    accept = flask.request.accept_mimetypes
+    wire_format = 'json'
+    if accept.quality(COLUMNS_TYPE) > accept.quality(JSON_TYPE):
+        wire_format = 'columns'
+    body, content_type = encode_message(message, wire_format)
+    response = flask.make_response(body, 200)
+    response.headers['Content-Type'] = content_type
+    return response
+
+
 @app.route('/status')
 def check_status():
     logger.debug("Request for current status")
@@ -303,7 +477,10 @@ def get_step():
     data.status_lock.acquire()
     step = {'step': data.step, 'step_size': data.step_size,
             'start_time': data.start_time, 'window_time': data.window_time,
-            'step_window': data.win_size}
+            'step_window': data.win_size, 'epsilon': data.epsilon,
+            'top_k': data.top_k, 'subspaces': data.subspaces,
+            'cards': data.cards,
+            'wire_formats': sorted(CONTENT_TYPES)}
     data.status_lock.release()
     return flask.make_response(flask.jsonify(step), 200)
 
@@ -313,11 +490,18 @@ def remove_worker():
     """When a worker is done, reduce the count of the number of workers"""
     logger.info("A worker has dropped out")
 
-    # worker_id = flask.request.args.get('worker_id')
+    worker_id = flask.request.args.get('worker_id')
     data.status_lock.acquire()
     step = {'step': data.step, 'step_size': data.step_size,
             'start_time': data.start_time, 'window_time': data.window_time}
-    data.num_workers -= 1
+    # a worker that already sent its data for this step is still
+    # waited on for this step, or the step could be computed without
+    # the last data from the other workers
+    if worker_id is not None and worker_id in data.recv_workers:
+        data.leaving += 1
+    else:
+        data.num_workers -= 1
+    data.changed.notify_all()
     data.status_lock.release()
     return flask.make_response(flask.jsonify(step), 200)
 
@@ -328,11 +512,24 @@ def get_skyline(step=None):
     """Return the skyline for the most recent step or return an error if
     requested step is not available
 
+    With a wait argument (in seconds), a request for a step that is
+    still being computed is held until it is done, for up to that long
+    (and LONG_POLL_WAIT at most), instead of answering with a 423 right
+    away
+
     """
     worker_id = flask.request.args.get('worker_id')
     logger.debug("Call from {} to get skyline {}".format(worker_id, step))
+    wait = None
+    if step is not None and 'wait' in flask.request.args:
+        try:
+            wait = min(float(flask.request.args['wait']), LONG_POLL_WAIT)
+        except ValueError:
+            flask.abort(400)
     try:
         data.status_lock.acquire()
+        if wait is not None:
+            data.wait_for_step(int(step), worker_id, wait)
         is_computing = data.is_computing
         is_running = data.is_running
         already_recv_worker = (worker_id in data.recv_workers)
@@ -375,9 +572,45 @@ def get_skyline(step=None):
     # otherwise return the latest skyline
     data.data_lock.acquire()
     # sky = {'step': (data.step - 1), 'data': data.skyline}
-    sky = data.skyline_changes[worker_id]
+    changes = data.skyline_changes[worker_id]
     data.data_lock.release()
+    sky = {'step': changes['step'], 'worker_id': changes['worker_id'],
+           'added': changes['added'], 'removed': changes['removed']}
+    if 'cube' in changes:
+        sky['cube'] = changes['cube']
     logger.debug("returning skyline to worker {}: {}".format(worker_id, sky))
+    return message_response(sky)
+
+
+@app.route('/skyline')
+def query_skyline():
+    """Return the latest global skyline over the dimensions in the dims
+    argument (like ?dims=0,2), which has to be one of the subspaces
+    the workers were asked to keep, or over all dimensions if dims is
+    left out
+
+    """
+    dims = flask.request.args.get('dims')
+    key = None
+    if dims is not None:
+        try:
+            key = subspace_key(sorted(set(int(dim)
+                                          for dim in dims.split(","))))
+        except ValueError:
+            flask.abort(400)
+    data.data_lock.acquire()
+    step = data.step - 1
+    skyline = data.subspace_skyline(key)
+    # the full space can also be asked for by listing every dimension
+    if skyline is None and len(data.skyline) > 0:
+        if key == subspace_key(range(len(data.skyline[0].data))):
+            skyline = data.subspace_skyline(None)
+    data.data_lock.release()
+    if skyline is None:
+        error = {'error': 'subspace {} is not in the skycube'.format(dims),
+                 'subspaces': sorted(data.cube_skys)}
+        return flask.make_response(flask.jsonify(error), 404)
+    sky = {'step': step, 'dims': dims, 'data': points_to_json(skyline)}
     return flask.make_response(flask.jsonify(sky), 200)
 
 
@@ -388,12 +621,12 @@ def accept_data():
 
     """
     # if they didn't include data, then generate an error
-    if not flask.request.json:
+    local_skyline = request_message()
+    if not local_skyline:
         logger.error("received update master request without data")
         flask.abort(400)
 
     # ensure that the data point corresponds to the correct time step
-    local_skyline = flask.request.get_json()
     logger.debug("received update master request: {}".format(local_skyline))
     try:
         data.status_lock.acquire()
@@ -417,6 +650,7 @@ def accept_data():
     data.status_lock.acquire()
     # data.have_new_data = True
     data.last_received_time = time.time()
+    data.changed.notify_all()
     data.status_lock.release()
 
     return flask.make_response(flask.jsonify({'status': 'success'}), 200)
@@ -434,6 +668,27 @@ def parse_args():
                         help='window size (number of steps)')
     parser.add_argument('--num-workers', required=True, type=int,
                         help='number of workers to wait for')
+    parser.add_argument('--engine', default=SKY_ENGINE,
+                        help='skyline engine to use (auto, bnl, vector, '
+                        'staircase, kdtree, spill, or bitmap)')
+    parser.add_argument('--metrics', default=METRICS_FILE,
+                        help='file to append skyline metrics to')
+    parser.add_argument('--epsilon', default=EPSILON, type=float,
+                        help='compute an approximate skyline where every '
+                        'skyline point is within a factor of 1 + epsilon '
+                        'of a reported point (shared with the workers)')
+    parser.add_argument('--top-k', default=TOP_K, type=int,
+                        help='only report the k skyline points that '
+                        'dominate the most other points (shared with the '
+                        'workers)')
+    parser.add_argument('--subspaces', default=SUBSPACES,
+                        help='also keep the skylines over these subsets of '
+                        'the dimensions, like 0,1;0,2;1,2, or all for every '
+                        'subset (the skycube)')
+    parser.add_argument('--cards', default=None,
+                        help='number of values of each dimension when they '
+                        'are all small non-negative integers, like 2,10,10, '
+                        'for the bitmap engine (shared with the workers)')
     return parser.parse_args()
 
 
@@ -451,9 +706,16 @@ if __name__ == "__main__":
     handler.setLevel(logging.DEBUG)
     logger.addHandler(handler)
 
+    cards = DISCRETE_CARDS
+    if args.cards is not None:
+        cards = parse_cards(args.cards)
+
     # create appropriate global datastructures
     data = Master(args.output, args.start, args.step, args.win_size,
-                  num_workers=args.num_workers)
+                  num_workers=args.num_workers, engine=args.engine,
+                  metrics_file=args.metrics, epsilon=args.epsilon,
+                  top_k=args.top_k, subspaces=args.subspaces,
+                  cards=cards)
 
     # start the background computation thread. This thread will
     # compute the skyline when appropriate and will update info on the
@@ -463,5 +725,6 @@ if __name__ == "__main__":
     bg.daemon = True
     bg.start()
 
-    # start the webserver
-    app.run(debug=True)
+    # start the webserver. Requests get their own threads, since long
+    # polls for the skyline wait on uploads from the other workers
+    app.run(debug=True, threaded=True)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# metrics.py: cheap in-process counters, gauges and histograms for the
+# skyline engines, exported as one compact JSON line every so often.
+# This replaces the RECORD_ALL per-point dumps
+
+
+# stdlib
+import json
+import time
+
+# local imports
+from constants import METRICS_SAMPLE, METRICS_INTERVAL
+
+
+class Histogram():
+    """Histogram with power of two buckets
+
+    Bucket i counts the values v with int(v).bit_length() == i, so
+    bucket 0 is 0, bucket 1 is 1, bucket 2 is 2-3, bucket 3 is 4-7, ...
+
+    """
+
+    def __init__(self):
+        self.buckets = []
+        self.count = 0
+        self.total = 0
+        self.max_val = 0
+
+    def add(self, value):
+        idx = int(value).bit_length()
+        if idx >= len(self.buckets):
+            self.buckets.extend([0] * (idx + 1 - len(self.buckets)))
+        self.buckets[idx] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max_val:
+            self.max_val = value
+
+    def to_json(self):
+        return {'count': self.count, 'sum': self.total, 'max': self.max_val,
+                'buckets': self.buckets}
+
+
+class Metrics():
+    """Counters, gauges and histograms for a master or worker
+
+    Points are counted per batch (see Skyline.add_sorted), and only the
+    comparisons of one point in every sample go into the histogram, so
+    the points in between cost nothing extra. The sizes of the
+    skyline and the candidates are recorded once per batch, and every
+    interval seconds the cumulative values are written to outf as a
+    single JSON line.
+
+    """
+
+    def __init__(self, outf=None, name=None, sample=METRICS_SAMPLE,
+                 interval=METRICS_INTERVAL):
+        self.outf = outf
+        self.name = name
+        self.sample = max(1, sample)
+        self.interval = interval
+        self.counters = {}
+        self.gauges = {}
+        self.hists = {}
+        self.last_export = time.time()
+
+    @classmethod
+    def open(cls, filename, name=None, **kwargs):
+        return cls(outf=open(filename, 'a'), name=name, **kwargs)
+
+    def incr(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, value):
+        if name not in self.hists:
+            self.hists[name] = Histogram()
+        self.hists[name].add(value)
+
+    def record_batch(self, sky, points, update):
+        """Call update on each point of the batch for the skyline sky and
+        return the points that were added, recording as we go
+
+        """
+        # the first point of every sample points is the one we look at,
+        # and the rest go through as fast as they would without metrics
+        added = []
+        for start in range(0, len(points), self.sample):
+            point = points[start]
+            if update(point):
+                added.append(point)
+            self.observe('comparisons', sky.comparisons)
+            added.extend([point for point in
+                          points[start + 1:start + self.sample]
+                          if update(point)])
+        self.incr('points', len(points))
+        self.incr('added', len(added))
+        self.observe('batch_size', len(points))
+        self.sizes(sky)
+        self.maybe_export()
+        return added
+
+    def sizes(self, sky):
+        self.gauge('sky_size', sky.skyline.qsize())
+        self.gauge('candidates', sky.non_sky.qsize())
+
+    def maybe_export(self):
+        if time.time() - self.last_export >= self.interval:
+            self.export()
+
+    def snapshot(self):
+        entry = {'time': time.time(), 'counters': self.counters,
+                 'gauges': self.gauges}
+        entry['hists'] = dict((name, self.hists[name].to_json())
+                              for name in self.hists)
+        if self.name is not None:
+            entry['name'] = self.name
+        return entry
+
+    def export(self):
+        """Write the current values out as one line of JSON"""
+        self.last_export = time.time()
+        if self.outf is None:
+            return
+        self.outf.write(json.dumps(self.snapshot(), separators=(',', ':')) +
+                        "\n")
+        self.outf.flush()
+
+    def close(self):
+        self.export()
+        if self.outf is not None:
+            self.outf.close()
+            self.outf = None
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# parallel_skyline.py: split a batch of points across a process pool,
+# compute the skyline of each partition in parallel, and hand back
+# only the points that survived so the worker's skyline can do the
+# final merge
+
+
+# stdlib
+import math
+import multiprocessing
+
+# local imports
+from constants import SKY_ENGINE, EPSILON, DISCRETE_CARDS
+from engines import make_skyline
+from skyline import SkylineException, WindowCandidates
+
+# constants
+PARTITIONS = ['angle', 'grid']
+# batches smaller than this aren't worth shipping to the pool
+PARALLEL_MIN_BATCH = 2000
+
+
+def angle_partition(points, num_parts):
+    """Split the points into num_parts by angle
+
+    We shift every point by the per-dimension minimum and use the
+    first hyperspherical angle, atan2(|x[1:]|, x[0]). Every partition
+    then spans the whole range of distances from the origin, so each
+    one has about the same share of skyline points (unlike slabs on a
+    single dimension, where the slab closest to the origin does all
+    the work)
+
+    """
+    dims = len(points[0].data)
+    mins = [min(point.data[idx] for point in points) for idx in range(dims)]
+
+    def angle(point):
+        data = point.data
+        rest = math.sqrt(sum((data[idx] - mins[idx]) ** 2
+                             for idx in range(1, dims)))
+        return math.atan2(rest, data[0] - mins[0])
+    return split_sorted(sorted(points, key=angle), num_parts)
+
+
+def grid_partition(points, num_parts):
+    """Split the points into num_parts slabs along the dimension with
+    the largest spread
+
+    """
+    dims = len(points[0].data)
+    spreads = []
+    for idx in range(dims):
+        values = [point.data[idx] for point in points]
+        spreads.append(max(values) - min(values))
+    dim = spreads.index(max(spreads))
+    ordered = sorted(points, key=lambda point: point.data[dim])
+    return split_sorted(ordered, num_parts)
+
+
+def split_sorted(points, num_parts):
+    size = int(math.ceil(len(points) / float(num_parts)))
+    return [points[idx:idx + size] for idx in range(0, len(points), size)]
+
+
+def partition_skyline(args):
+    """Compute the skyline of one partition (runs in the pool)
+
+    Returns (skyline points, candidates). The candidates are the
+    points that are only dominated by older points, which is what a
+    WindowCandidates store keeps
+
+    """
+    engine, dims, epsilon, cards, points = args
+    sky = make_skyline(engine, dims=dims, epsilon=epsilon, cards=cards)
+    sky.non_sky = WindowCandidates()
+    sky.update_sky_for_points(points)
+    return sky.skyline.snapshot(), sky.non_sky.snapshot()
+
+
+class ParallelFilter():
+    """Process pool that filters a batch down to the union of the
+    skylines of its partitions
+
+    A point that is dominated inside its partition by a point that is
+    at least as new can never be in the skyline under a sliding window,
+    so we can drop it before the worker's skyline sees it. The worker
+    then merges what is left into its skyline as usual
+
+    The partitions have no CreditLedger, so each step of the batch is
+    partitioned on its own: whatever is folded into a point in the pool
+    comes from its own step and expires with it. Points that already
+    carry credits from other steps skip the pool for the same reason
+
+    """
+
+    def __init__(self, procs, engine=SKY_ENGINE, dims=None,
+                 partition='angle', epsilon=EPSILON, cards=DISCRETE_CARDS):
+        if partition not in PARTITIONS:
+            raise SkylineException("unknown partitioning {}"
+                                   "".format(partition))
+        self.procs = procs
+        self.engine = engine
+        self.dims = dims
+        self.partition = partition
+        self.epsilon = epsilon
+        self.cards = cards
+        self.pool = multiprocessing.Pool(processes=procs)
+
+    def prefilter(self, points):
+        """Return the points from the batch that survive their
+        partition's skyline
+
+        """
+        if len(points) < PARALLEL_MIN_BATCH:
+            return points
+        survivors = []
+        by_step = {}
+        for point in points:
+            if point.credits:
+                survivors.append(point)
+            else:
+                by_step.setdefault(point.step, []).append(point)
+        jobs = []
+        for step in sorted(by_step):
+            group = by_step[step]
+            if len(group) < PARALLEL_MIN_BATCH:
+                survivors.extend(group)
+                continue
+            if self.partition == 'angle':
+                parts = angle_partition(group, self.procs)
+            else:
+                parts = grid_partition(group, self.procs)
+            jobs.extend((self.engine, self.dims, self.epsilon, self.cards,
+                         part) for part in parts)
+        if len(jobs) == 0:
+            return survivors
+        for skyline, candidates in self.pool.map(partition_skyline, jobs):
+            survivors.extend(skyline)
+            survivors.extend(candidates)
+        return survivors
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
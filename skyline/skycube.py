@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# skycube.py: skylines over subsets of the dimensions (subspaces),
+# kept up to date from the same stream as the full skyline so that the
+# skyline of any declared subspace can be served without another pass
+# over the input
+
+
+# stdlib
+import itertools
+
+# local imports
+from constants import SKY_ENGINE, EPSILON, DISCRETE_CARDS, SPILL_BUDGET
+from engines import make_skyline
+from skyline import SkyPoint, SkylineException
+
+
+def subspace_key(dims):
+    """Return the name of a subspace, like 0,2 for dimensions 0 and 2
+    (JSON object keys have to be strings)
+
+    """
+    return ",".join(str(dim) for dim in dims)
+
+
+def parse_subspaces(spec, dims):
+    """Return the list of subspaces (sorted tuples of dimensions) that
+    spec declares for points with dims dimensions
+
+    spec is either all, for every proper subset of the dimensions (the
+    full skycube), or subspaces separated by semicolons, like 0,1;0,2.
+    The full space is left out since it is the regular skyline
+
+    """
+    if spec is None or dims is None:
+        return []
+    if spec == 'all':
+        return [subspace for size in range(1, dims)
+                for subspace in itertools.combinations(range(dims), size)]
+    subspaces = []
+    for part in spec.split(";"):
+        try:
+            subspace = tuple(sorted(set(int(dim) for dim in part.split(","))))
+        except ValueError:
+            raise SkylineException("bad subspace {}".format(part))
+        if len(subspace) == 0 or subspace[0] < 0 or subspace[-1] >= dims:
+            raise SkylineException("subspace {} is out of range for {} "
+                                   "dimensions".format(part, dims))
+        if len(subspace) < dims and subspace not in subspaces:
+            subspaces.append(subspace)
+    return subspaces
+
+
+def project(point, subspace):
+    """Return a copy of point with only the dimensions in subspace"""
+    data = tuple(point.data[dim] for dim in subspace)
+    return SkyPoint(point.step, data, point.extra)
+
+
+class SkyCube():
+    """A skyline for each of a set of subspaces
+
+    Every batch is projected onto each subspace and merged into that
+    subspace's skyline, which is a regular skyline from make_skyline
+    (so it gets the same window, candidates and approximation as the
+    full one). Note that the skyline of a subspace is not a subset of
+    the full skyline when there are ties, which are common in count
+    columns, so each subspace needs its own skyline rather than a
+    filter over the full one.
+
+    Each subspace also keeps the points we last uploaded for it in top
+    k mode, like the worker does for the full skyline (see
+    Worker.find_skyline_diff).
+
+    """
+
+    def __init__(self, subspaces, engine=SKY_ENGINE, win_size=None,
+                 epsilon=EPSILON, cards=DISCRETE_CARDS,
+                 budget=SPILL_BUDGET):
+        self.subspaces = dict((subspace_key(subspace), subspace)
+                              for subspace in subspaces)
+        self.skys = {}
+        self.uploaded = {}
+        for key in self.subspaces:
+            subspace = self.subspaces[key]
+            sub_cards = None
+            if cards is not None:
+                sub_cards = [cards[dim] for dim in subspace]
+            self.skys[key] = make_skyline(engine, dims=len(subspace),
+                                          win_size=win_size, epsilon=epsilon,
+                                          cards=sub_cards, budget=budget)
+            self.uploaded[key] = None
+
+    def keys(self):
+        return sorted(self.skys)
+
+    def update_sky_for_points(self, points):
+        """Update the skyline of every subspace for a batch of points
+
+        Returns a dict from subspace key to the points from the batch
+        that were added to that subspace's skyline
+
+        """
+        added = {}
+        for key in self.skys:
+            subspace = self.subspaces[key]
+            projected = [project(point, subspace) for point in points]
+            added[key] = self.skys[key].update_sky_for_points(projected)
+        return added
+
+    def skyline(self, key):
+        """Return the current skyline of the subspace with the given key"""
+        if key not in self.skys:
+            raise SkylineException("subspace {} was not declared"
+                                   "".format(key))
+        return self.skys[key].get_sky_as_list()
@@ -7,11 +7,10 @@
 
 
 # stdlib
-import json
-import Queue
-import time
+import heapq
+import math
 
-from constants import REMOVE_DUPS, RECORD_ALL
+from constants import REMOVE_DUPS, MOVE_TO_FRONT
 
 
 def test_skyline():
@@ -19,11 +18,10 @@ def test_skyline():
     test_list = [[50, 3.0], [51, 5.0], [52, 4.0], [53, 2.0], [65, 1.0],
                  [25, 100.0], [26, 95.0], [49, 4.0], [51, 2.0], [31, 67]]
     sky = Skyline()
-    sky.compute_all_sky(test_list)
+    sky.compute_all_sky([SkyPoint(0, data) for data in test_list])
 
     print "The skyline points are:"
-    while not sky.skyline.empty():
-        point = sky.skyline.get_nowait()
+    for point in sky.skyline:
         print point
 
 
@@ -31,14 +29,785 @@ class SkylineException(Exception):
     pass
 
 
+class SkyPoint(object):
+    """Compact representation of a data point
+
+    Points used to be dicts like {'step': 0, 'data': [1, 2], ...}, and
+    we kept building tuple(data) + (step,) keys out of them. A
+    SkyPoint uses __slots__, keeps data as a tuple and precomputes its
+    hash, so points can go straight into sets and dicts. Two points
+    are equal if they have the same data and step.
+
+    Any other fields (like the KDD class label) are kept in extra as
+    a tuple of (name, value) pairs. We only convert to and from the
+    JSON dict shape at the HTTP boundary (to_json and from_json).
+
+    count is the number of live input points with these coordinates
+    that this one stands for, itself included (see
+    Skyline.absorb_duplicate), and dominates is the number of points it
+    was found to dominate (see Skyline.demote). Neither is part of the
+    hash or equality. Under a sliding window, credits has the copies
+    and dominated points that came from other steps, by step, so that
+    they can be taken back when their step expires (see CreditLedger).
+
+    On a worker, synced is the (count, dominates) that the master has
+    for the point, or None if the master doesn't have it (see
+    Worker.diff_skyline).
+
+    """
+
+    __slots__ = ('step', 'data', 'extra', 'count', 'dominates', 'credits',
+                 'synced', 'hash_val')
+
+    def __init__(self, step, data, extra=None, count=1, dominates=0,
+                 credits=None, synced=None):
+        self.step = step
+        self.data = tuple(data)
+        self.extra = extra
+        self.count = count
+        self.dominates = dominates
+        self.credits = credits
+        self.synced = synced
+        self.hash_val = hash((self.data, step))
+
+    def __hash__(self):
+        return self.hash_val
+
+    def __eq__(self, other):
+        if not isinstance(other, SkyPoint):
+            return NotImplemented
+        return self.step == other.step and self.data == other.data
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return "SkyPoint(step={}, data={})".format(self.step, self.data)
+
+    def __getstate__(self):
+        return (self.step, self.data, self.extra, self.count,
+                self.dominates, self.credits, self.synced)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def copy(self):
+        return SkyPoint(self.step, self.data, self.extra, self.count,
+                        self.dominates, self.copy_credits(), self.synced)
+
+    def copy_credits(self):
+        if self.credits is None:
+            return None
+        return dict((step, list(entry))
+                    for step, entry in self.credits.items())
+
+    def to_json(self):
+        # not count, which is also the name of a KDD column
+        entry = {'step': self.step, 'data': list(self.data),
+                 'multiplicity': self.count, 'dominates': self.dominates}
+        if self.extra is not None:
+            entry.update(self.extra)
+        return entry
+
+    @classmethod
+    def from_json(cls, entry):
+        extra = [(name, entry[name]) for name in sorted(entry)
+                 if name not in ('step', 'data', 'multiplicity',
+                                 'dominates')]
+        if len(extra) == 0:
+            extra = None
+        else:
+            extra = tuple(extra)
+        return cls(entry['step'], entry['data'], extra,
+                   entry.get('multiplicity', 1), entry.get('dominates', 0))
+
+
+def points_to_json(points):
+    return [point.to_json() for point in points]
+
+
+def points_from_json(entries):
+    return [SkyPoint.from_json(entry) for entry in entries]
+
+
+def sfs_key(point):
+    """Sort key for sort-filter-skyline (SFS) presorting
+
+    The coordinate sum is monotone with dominance: if point1 dominates
+    point2, then point1 has a strictly smaller sum. Duplicates have
+    the same sum, so we break ties with the newest step first to match
+    the REMOVE_DUPS tie-break in check_dominated.
+
+    """
+    return (sum(point.data), -point.step)
+
+
+def snap_value(value, epsilon):
+    """Round value down to a power of (1 + epsilon) (0 stays 0)"""
+    if value < 0:
+        raise SkylineException("approximate skylines only support "
+                               "non-negative coordinates")
+    if value == 0:
+        return 0
+    # the slack keeps values that are already on the grid in place
+    exp = math.floor(math.log(value) / math.log1p(epsilon) + 1e-9)
+    return (1 + epsilon) ** exp
+
+
+def snap_point(point, epsilon):
+    """Return a copy of point with its coordinates on the epsilon grid
+
+    Snapping is monotone, so it never breaks a dominance, and each
+    coordinate only shrinks by up to a factor of (1 + epsilon). So if
+    the snapped q is dominated by (or equal to) the snapped p, then p
+    epsilon-dominates q: p[i] <= (1 + epsilon) * q[i] in every
+    dimension. Points in the same grid cell become duplicates, which
+    absorb_duplicate folds into one counted point.
+
+    """
+    data = tuple(snap_value(value, epsilon) for value in point.data)
+    if data == point.data:
+        # already on the grid (like a candidate that is run again), so
+        # the point keeps its place in the ledger (see CreditLedger)
+        return point
+    return SkyPoint(point.step, data, point.extra, point.count,
+                    point.dominates, point.copy_credits())
+
+
+class StepRing():
+    """Per-step buckets of points arranged as a ring of win_size slots
+
+    Step s lives in slot s % win_size, so expiring a step drops its
+    whole bucket without looking at the points in the other steps. A
+    step that collides with an older step that hasn't been expired yet
+    goes into the overflow buckets, which are normally empty.
+
+    """
+
+    def __init__(self, win_size):
+        self.win_size = max(1, win_size)
+        self.slots = [None] * self.win_size
+        self.overflow = {}
+        self.size = 0
+
+    def bucket(self, step, create=False):
+        slot = step % self.win_size
+        entry = self.slots[slot]
+        if entry is not None and entry[0] == step:
+            return entry[1]
+        if step in self.overflow:
+            return self.overflow[step]
+        if not create:
+            return None
+        if entry is None or len(entry[1]) == 0:
+            self.slots[slot] = (step, {})
+            return self.slots[slot][1]
+        self.overflow[step] = {}
+        return self.overflow[step]
+
+    def add(self, point):
+        self.bucket(point.step, create=True)[id(point)] = point
+        self.size += 1
+
+    def remove(self, point):
+        bucket = self.bucket(point.step)
+        if bucket is not None and id(point) in bucket:
+            del bucket[id(point)]
+            self.size -= 1
+
+    def clear(self):
+        self.slots = [None] * self.win_size
+        self.overflow = {}
+        self.size = 0
+
+    def expire(self, oldest_step):
+        """Remove and return every point with step <= oldest_step"""
+        expired = []
+        for slot in range(self.win_size):
+            entry = self.slots[slot]
+            if entry is not None and entry[0] <= oldest_step:
+                expired.extend(entry[1].values())
+                self.slots[slot] = None
+        for step in [step for step in self.overflow if step <= oldest_step]:
+            expired.extend(self.overflow.pop(step).values())
+        self.size -= len(expired)
+        return expired
+
+    def counts(self):
+        """Return a dict with the number of points alive in each step"""
+        counts = {}
+        for entry in self.slots:
+            if entry is not None and len(entry[1]) > 0:
+                counts[entry[0]] = len(entry[1])
+        for step in self.overflow:
+            if len(self.overflow[step]) > 0:
+                counts[step] = len(self.overflow[step])
+        return counts
+
+
+class CreditLedger():
+    """The copies and dominated points that points took over from other
+    steps
+
+    A point that absorbs a duplicate (see Skyline.fold) adds the
+    duplicate's count to its own, and a point that dominates another
+    one adds that point (and its score) to its dominates score (see
+    Skyline.demote). Under a sliding window, those points leave the
+    window with their step, which can come before the point's own. So
+    each point keeps what it took over in its credits, a dict from step
+    to [copies, dominated], and the ledger lists the points that hold
+    credits for each step. Expiring a step then takes its credits back
+    from just those points.
+
+    """
+
+    def __init__(self):
+        self.holders = {}
+
+    def credit(self, holder, step, copies, dominated):
+        holder.count += copies
+        holder.dominates += dominated
+        if step == holder.step:
+            # these leave the window along with holder
+            return
+        if holder.credits is None:
+            holder.credits = {}
+        if step in holder.credits:
+            entry = holder.credits[step]
+            entry[0] += copies
+            entry[1] += dominated
+            return
+        holder.credits[step] = [copies, dominated]
+        self.holders.setdefault(step, {})[id(holder)] = holder
+
+    def own(self, point):
+        """Return the copies and dominated points of point that leave
+        the window along with it
+
+        """
+        copies, dominated = point.count, point.dominates
+        if point.credits is not None:
+            for entry in point.credits.values():
+                copies -= entry[0]
+                dominated -= entry[1]
+        return copies, dominated
+
+    def fold(self, holder, point):
+        """Credit holder with the copies and score of point, by step"""
+        copies, dominated = self.own(point)
+        if point.credits is not None:
+            for step, entry in point.credits.items():
+                self.credit(holder, step, entry[0], entry[1])
+        self.credit(holder, point.step, copies, dominated)
+
+    def dominate(self, holder, point):
+        """Credit holder with point and everything that point dominated,
+        by step
+
+        """
+        if point.credits is None:
+            self.credit(holder, point.step, 0, point.count + point.dominates)
+            return
+        copies, dominated = self.own(point)
+        for step, entry in point.credits.items():
+            self.credit(holder, step, 0, entry[0] + entry[1])
+        self.credit(holder, point.step, 0, copies + dominated)
+
+    def withdraw(self, holder, point):
+        """Take back what holder was credited for dominating point (or
+        more, if point has taken over more since), for when point will
+        be credited to a dominator again
+
+        """
+        copies, dominated = self.own(point)
+        amounts = [(point.step, copies + dominated)]
+        if point.credits is not None:
+            amounts.extend((step, entry[0] + entry[1])
+                           for step, entry in point.credits.items())
+        for step, amount in amounts:
+            if step == holder.step:
+                # not in the credits, but at most what holder has
+                taken = min(amount, holder.dominates)
+            elif holder.credits is not None and step in holder.credits:
+                entry = holder.credits[step]
+                taken = min(amount, entry[1])
+                entry[1] -= taken
+            else:
+                continue
+            holder.dominates -= taken
+
+    def expire(self, oldest_step):
+        """Take back the credits from every step <= oldest_step"""
+        for step in [step for step in self.holders if step <= oldest_step]:
+            for holder in self.holders.pop(step).values():
+                self.settle(holder, oldest_step)
+
+    def settle(self, point, oldest_step):
+        """Take back the credits of point from every step <= oldest_step
+        (for points that the ledger no longer lists, see forget)
+
+        """
+        if point.credits is None:
+            return
+        for step in [step for step in point.credits if step <= oldest_step]:
+            copies, dominated = point.credits.pop(step)
+            point.count -= copies
+            point.dominates -= dominated
+
+    def enlist(self, points):
+        """List points that took over credits somewhere else (like the
+        worker's staged points) under the steps of their credits
+
+        """
+        for point in points:
+            if point.credits is None:
+                continue
+            for step in point.credits:
+                self.holders.setdefault(step, {})[id(point)] = point
+
+    def forget(self, points):
+        """Stop listing points (like the ones that are spilled to disk),
+        which then have to be settled by whoever reads them back
+
+        """
+        for point in points:
+            if point.credits is None:
+                continue
+            for step in point.credits:
+                if step in self.holders:
+                    self.holders[step].pop(id(point), None)
+
+
+class SkyStore():
+    """Single-threaded container for skyline and non-skyline points
+
+    The skyline is only ever touched from one thread at a time (the
+    worker's main loop or the master's data_lock), so we don't need
+    the locking that Queue.Queue does on every get/put. Points are
+    kept in a plain list, so we can iterate over them directly and
+    remove points in place instead of rotating the whole queue.
+
+    self.pos has the position of each point in the list (by id), so
+    remove_points can move the last point into the hole that a point
+    leaves instead of scanning the list. The order of the points only
+    matters to the BNL scan (see MOVE_TO_FRONT), which is why that is
+    fine.
+
+    Stores can also keep their points in a StepRing (see track_steps)
+    and index them by coordinates (see track_data), so every method
+    that adds or removes points has to go through track_add,
+    track_remove or track_reset. self.additions counts the calls that
+    can add points, so Skyline.compact_candidates can tell if anything
+    new came in since it last ran.
+
+    """
+
+    def __init__(self, items=None):
+        self.items = []
+        self.pos = {}
+        self.ring = None
+        self.by_data = None
+        self.additions = 0
+        if items is not None:
+            self.items = list(items)
+            self.reindex()
+
+    def reindex(self):
+        self.pos = dict((id(item), idx)
+                        for idx, item in enumerate(self.items))
+
+    def track_steps(self, ring):
+        """Keep the points of this store in the StepRing ring as well"""
+        self.ring = ring
+        self.track_reset(self)
+
+    def track_data(self):
+        """Keep a dict from coordinates to the point with those
+        coordinates (only for stores without duplicates, like a
+        skyline with REMOVE_DUPS)
+
+        """
+        self.by_data = {}
+        self.track_reset(self)
+
+    def track_add(self, item):
+        self.additions += 1
+        if self.ring is not None:
+            self.ring.add(item)
+        if self.by_data is not None:
+            self.by_data[item.data] = item
+
+    def track_remove(self, items):
+        if self.ring is not None:
+            for item in items:
+                self.ring.remove(item)
+        if self.by_data is not None:
+            for item in items:
+                if self.by_data.get(item.data) is item:
+                    del self.by_data[item.data]
+
+    def track_reset(self, items):
+        self.additions += 1
+        if self.ring is not None:
+            self.ring.clear()
+            for item in items:
+                self.ring.add(item)
+        if self.by_data is not None:
+            self.by_data = dict((item.data, item) for item in items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def qsize(self):
+        return len(self.items)
+
+    def empty(self):
+        return len(self.items) == 0
+
+    def put(self, item):
+        self.pos[id(item)] = len(self.items)
+        self.items.append(item)
+        self.track_add(item)
+
+    def extend(self, items):
+        for item in items:
+            self.put(item)
+
+    def snapshot(self):
+        """Return a copy of the points that is safe to hold onto"""
+        return list(self.items)
+
+    def replace(self, items):
+        """Replace the contents of the store with the list items"""
+        self.items = items
+        self.reindex()
+        self.track_reset(items)
+
+    def retain(self, keep):
+        """Keep only the points where keep(point) is true
+
+        Returns the list of points that were removed
+
+        """
+        kept, removed = [], []
+        for item in self.items:
+            if keep(item):
+                kept.append(item)
+            else:
+                removed.append(item)
+        self.items = kept
+        self.reindex()
+        self.track_remove(removed)
+        return removed
+
+    def remove_points(self, points):
+        """Remove the given points (matched by identity, points that
+        are not in the store are skipped)
+
+        This takes time for the points removed, not the whole store
+
+        """
+        removed = []
+        for point in points:
+            idx = self.pos.pop(id(point), None)
+            if idx is None:
+                continue
+            last = len(self.items) - 1
+            if idx != last:
+                self.move(last, idx)
+            self.items.pop()
+            removed.append(point)
+        self.track_remove(removed)
+
+    def move(self, src, dst):
+        """Move the point at position src over the one at dst"""
+        item = self.items[src]
+        self.items[dst] = item
+        self.pos[id(item)] = dst
+
+    def drain(self):
+        """Remove and return all of the points in the store"""
+        items = self.items
+        self.items = []
+        self.pos = {}
+        self.track_reset([])
+        return items
+
+    def move_to_front(self, idx):
+        """Move the point at position idx to the front of the store"""
+        items = self.items
+        items.insert(0, items.pop(idx))
+        # only the points up to idx have moved, and the scan that
+        # found the point has looked at all of them already
+        for pos in range(idx + 1):
+            self.pos[id(items[pos])] = pos
+
+    def position(self, item):
+        idx = self.pos.get(id(item))
+        if idx is None or self.items[idx] is not item:
+            raise SkylineException("point is not in the store")
+        return idx
+
+    def swap(self, old, new):
+        """Put new in old's place (they have the same coordinates)"""
+        idx = self.position(old)
+        self.items[idx] = new
+        del self.pos[id(old)]
+        self.pos[id(new)] = idx
+        self.track_remove([old])
+        self.track_add(new)
+
+    def put_dominated(self, item, dominator):
+        """Add a point that was just dominated by dominator"""
+        self.put(item)
+
+    def transfer(self, old, new):
+        """Hand the points that depend on old over to new (nothing to
+        hand over for a plain store)
+
+        """
+        pass
+
+    def release(self, sky_points):
+        """Remove and return the points that need another look now that
+        sky_points have left the skyline
+
+        A plain store doesn't know what dominated its points, so all of
+        them need another look
+
+        """
+        return self.drain()
+
+    def unlink(self, sky_points):
+        """Forget that sky_points dominate anything (nothing to forget for
+        a plain store)
+
+        """
+        pass
+
+    def compact(self, sky_points, check_dominated, fold):
+        """Drop points that can never be promoted (nothing to drop for a
+        plain store)
+
+        Returns the number of points dropped
+
+        """
+        return 0
+
+
+class WindowCandidates(SkyStore):
+    """Non-skyline store for sliding window skylines
+
+    Under a sliding window, a point that is dominated by a point with
+    the same or a newer step can never reach the skyline again: the
+    dominating point will be in the window for at least as long. We
+    drop those points right away, so only the points that could still
+    be promoted when an older skyline point expires are kept.
+
+    Every candidate also remembers the skyline point that dominated
+    it. self.deps maps id(dominator) to (dominator, candidates), so
+    when a skyline point leaves the skyline, release only hands back
+    the candidates that depended on it. Candidates added without a
+    dominator are kept under NO_DOMINATOR and are always released.
+
+    """
+
+    NO_DOMINATOR = None
+
+    def __init__(self, items=None):
+        SkyStore.__init__(self)
+        self.deps = {}
+        self.size = 0
+        self.dropped = 0
+        if items is not None:
+            self.extend(items)
+
+    def __iter__(self):
+        for dominator, items in self.deps.values():
+            for item in items:
+                yield item
+
+    def __len__(self):
+        return self.size
+
+    def qsize(self):
+        return self.size
+
+    def empty(self):
+        return self.size == 0
+
+    def add_dependent(self, item, dominator):
+        if dominator is None:
+            key = self.NO_DOMINATOR
+        else:
+            key = id(dominator)
+        if key not in self.deps:
+            self.deps[key] = (dominator, [])
+        self.deps[key][1].append(item)
+        self.size += 1
+        self.track_add(item)
+
+    def dependents(self, point):
+        """Return the candidates that depend on point"""
+        if id(point) not in self.deps:
+            return []
+        return self.deps[id(point)][1]
+
+    def pop_dependents(self, point):
+        """Remove and return the candidates that depend on point"""
+        if id(point) not in self.deps:
+            return []
+        items = self.deps.pop(id(point))[1]
+        self.size -= len(items)
+        self.track_remove(items)
+        return items
+
+    def put(self, item):
+        self.add_dependent(item, None)
+
+    def remove_points(self, points):
+        to_remove = set(id(point) for point in points)
+        self.retain(lambda item: id(item) not in to_remove)
+
+    def extend(self, items):
+        for item in items:
+            self.put(item)
+
+    def snapshot(self):
+        return list(self)
+
+    def replace(self, items):
+        self.drain()
+        self.extend(items)
+
+    def retain(self, keep):
+        removed = []
+        for key in list(self.deps.keys()):
+            dominator, items = self.deps[key]
+            kept = []
+            for item in items:
+                if keep(item):
+                    kept.append(item)
+                else:
+                    removed.append(item)
+            if len(kept) > 0:
+                self.deps[key] = (dominator, kept)
+            else:
+                del self.deps[key]
+        self.size -= len(removed)
+        self.track_remove(removed)
+        return removed
+
+    def drain(self):
+        items = list(self)
+        self.deps = {}
+        self.size = 0
+        self.track_reset([])
+        return items
+
+    def put_dominated(self, item, dominator):
+        # anything that item dominated is also dominated by dominator
+        # (and item is about to leave the skyline), so move item's
+        # dependents over to dominator
+        for dependent in self.pop_dependents(item):
+            self.put_dominated(dependent, dominator)
+        if dominator.step >= item.step:
+            self.dropped += 1
+            return
+        self.add_dependent(item, dominator)
+
+    def transfer(self, old, new):
+        for dependent in self.pop_dependents(old):
+            self.put_dominated(dependent, new)
+
+    def release(self, sky_points):
+        """Remove and return the candidates that depended on sky_points
+        (plus the ones we don't know the dominator for)
+
+        """
+        items = []
+        for point in sky_points:
+            items.extend(self.pop_dependents(point))
+        if self.NO_DOMINATOR in self.deps:
+            no_dom = self.deps.pop(self.NO_DOMINATOR)[1]
+            self.size -= len(no_dom)
+            self.track_remove(no_dom)
+            items.extend(no_dom)
+        return items
+
+    def unlink(self, sky_points):
+        """Move the candidates that depend on sky_points over to
+        NO_DOMINATOR (for when we can't keep sky_points in memory)
+
+        """
+        for point in sky_points:
+            for item in self.pop_dependents(point):
+                self.put(item)
+
+    def compact(self, sky_points, check_dominated, fold):
+        """Drop the candidates that are dominated by a skyline point or
+        another candidate that is at least as new
+
+        put_dominated only sees the point that dominated a candidate
+        when it left the skyline, so newer points that arrived later
+        are caught here. We go from the newest point to the oldest, so
+        every point that could drop a candidate has already been seen.
+        A candidate that is dropped for a duplicate (with REMOVE_DUPS)
+        is folded into it with fold(kept, dropped), so its count isn't
+        lost. Returns the number of points dropped
+
+        """
+        points = [(item, True) for item in sky_points]
+        points.extend([(item, False) for item in self])
+        points.sort(key=lambda entry: (-entry[0].step,
+                                       sfs_key(entry[0])))
+        kept, dropped = [], set()
+        for item, is_sky in points:
+            dominator = None
+            if not is_sky:
+                for other in kept:
+                    if check_dominated(item, other) == -1:
+                        dominator = other
+                        break
+            if dominator is not None:
+                if dominator.data == item.data:
+                    fold(dominator, item)
+                dropped.add(id(item))
+                continue
+            kept.append(item)
+        if len(dropped) == 0:
+            return 0
+        self.retain(lambda item: id(item) not in dropped)
+        self.dropped += len(dropped)
+        return len(dropped)
+
+
 class Skyline():
     """Class to perform skyline checks"""
 
     def __init__(self, skyline=None, non_sky=None):
-        self.non_sky = Queue.Queue()
-        self.skyline = Queue.Queue()
-        # if RECORD_ALL:
-        #     self.comp_size = open('sky-comp-size.json', 'w')
+        self.non_sky = SkyStore()
+        self.skyline = SkyStore()
+        # Metrics to record into (see metrics.py), if any, and the
+        # number of comparisons the last point took
+        self.metrics = None
+        self.comparisons = 0
+        # grid for approximate skylines (see snap_point), if any
+        self.epsilon = None
+        # copies and dominated points from other steps under a sliding
+        # window (see track_steps)
+        self.ledger = None
+        # the points that the master has (see SkyPoint.synced) which
+        # have left the skyline since the last take_departed, by id
+        self.departed = {}
+        # the additions of both stores when compact_candidates last ran
+        self.compacted = None
         if skyline is not None:
             self.skyline = skyline
         if non_sky is not None:
@@ -46,20 +815,95 @@ class Skyline():
 
     def get_sky_as_list(self):
         """Get the skyline as a list (troubleshooting function)"""
-
-        to_see = self.skyline.qsize() - 1
-        sky = []
-        while to_see > 0:
-            to_see -= 1
-            item = self.skyline.get_nowait()
-            self.skyline.put(item)
-            sky.append(item)
-        return sky
+        return self.skyline.snapshot()
 
     def compute_all_sky(self, in_tuples):
         """Compute the skyline from a full set of data points"""
-        for point in in_tuples:
-            self.update_sky_for_point(point)
+        self.update_sky_for_points(in_tuples)
+
+    def update_sky_for_points(self, points):
+        """Update the skyline for a batch of data points
+
+        The batch is presorted with sfs_key, so no point in the batch
+        can dominate a point that came before it. This means that a
+        point from the batch that enters the skyline is never evicted
+        by the rest of the batch.
+
+        Returns the list of points from the batch that were added to
+        the skyline (snapped to the grid in approximate mode)
+
+        """
+        points = self.snap_points(points)
+        return self.add_sorted(sorted(points, key=sfs_key),
+                               self.update_sky_for_point)
+
+    def snap_points(self, points):
+        """Snap the points to the epsilon grid in approximate mode
+
+        The skyline then holds at most one point per grid cell, which
+        bounds its size by the number of cells on the skyline of the
+        grid instead of the number of points
+
+        """
+        if self.epsilon is None:
+            return points
+        return [snap_point(point, self.epsilon) for point in points]
+
+    def add_sorted(self, points, update):
+        """Call update on each point of a presorted batch and return the
+        points that were added to the skyline
+
+        With metrics, the batch goes through Metrics.record_batch,
+        which samples the comparisons along the way
+
+        """
+        if self.metrics is not None:
+            return self.metrics.record_batch(self, points, update)
+        return [point for point in points if update(point)]
+
+    def demote(self, item, dominator):
+        """Hand item to the non-skyline store now that dominator
+        dominates it
+
+        dominator also dominates everything that item dominated, so it
+        takes over item's dominates score as well as item itself. Each
+        point is only credited to the dominator that found it, and under
+        a sliding window the credits for a step are taken back when it
+        expires (see CreditLedger), so the score is a lower bound on the
+        number of points in the window that are dominated
+
+        """
+        if self.ledger is None or (item.step == dominator.step and
+                                   item.credits is None):
+            # nothing to take back before dominator itself expires
+            dominator.dominates += item.count + item.dominates
+        else:
+            self.ledger.dominate(dominator, item)
+        self.depart(item)
+        self.non_sky.put_dominated(item, dominator)
+
+    def depart(self, point):
+        """Note that point has left the skyline, if the master has it"""
+        if point.synced is not None:
+            self.departed[id(point)] = point
+
+    def take_departed(self):
+        """Return the points from depart since the last call (some of
+        them may be back in the skyline by now)
+
+        """
+        departed, self.departed = self.departed, {}
+        return departed.values()
+
+    def representatives(self, k):
+        """Return the (at most) k skyline points that dominate the most
+        other points, breaking ties with the count and then the newest
+        step
+
+        """
+        return heapq.nlargest(k, self.skyline,
+                              key=lambda point: (point.dominates,
+                                                 point.count, point.step))
 
     def check_dominated(self, point1, point2, remove_dups=REMOVE_DUPS):
         """Compare the two points to see if one dominates the other
@@ -73,7 +917,7 @@ class Skyline():
 
         """
         dominates, dominated = False, False
-        data1, data2 = point1['data'], point2['data']
+        data1, data2 = point1.data, point2.data
         if len(data1) != len(data2):
             raise SkylineException("data points have unequal dimensions")
         for idx in range(len(data1)):
@@ -87,12 +931,54 @@ class Skyline():
         elif ((not dominates) and dominated):
             return -1
         if remove_dups and (not dominates):
-            if point1['step'] > point2['step']:
+            if point1.step > point2.step:
                 return 1
             else:
                 return -1
         return 0
 
+    def absorb_duplicate(self, point):
+        """Fold point into the skyline point with the same coordinates,
+        if there is one, without a dominance check
+
+        With REMOVE_DUPS, the copy with the newest step stays in the
+        skyline (an equal step keeps the existing point) and takes on
+        the count of the other copy, which is dropped. Returns None if
+        there was no duplicate, otherwise True if point took the
+        existing point's place
+
+        """
+        if not REMOVE_DUPS:
+            return None
+        if self.skyline.by_data is None:
+            self.skyline.track_data()
+        existing = self.skyline.by_data.get(point.data)
+        if existing is None:
+            return None
+        replaced = point.step > existing.step
+        if replaced:
+            self.fold(point, existing)
+            self.skyline.swap(existing, point)
+            self.non_sky.transfer(existing, point)
+        else:
+            self.fold(existing, point)
+        self.comparisons = 0
+        if self.metrics is not None:
+            self.metrics.incr('absorbed')
+        return replaced
+
+    def fold(self, holder, point):
+        """Fold the count and dominates score of point into holder,
+        which has the same coordinates and takes point's place
+
+        """
+        if self.ledger is None:
+            holder.count += point.count
+            holder.dominates += point.dominates
+        else:
+            self.ledger.fold(holder, point)
+        self.depart(point)
+
     def update_sky_for_point(self, point):
         """Update the skyline for a new data point
 
@@ -105,45 +991,133 @@ class Skyline():
         # add the tuple if there is nothing to compare to
         if self.skyline.empty():
             self.skyline.put(point)
+            self.comparisons = 0
             return True
 
+        # duplicates of a skyline point don't need a scan
+        absorbed = self.absorb_duplicate(point)
+        if absorbed is not None:
+            return absorbed
+
         is_dominated = False
-        to_see = self.skyline.qsize()
-        while to_see > 0:
-            cmp_tup = self.skyline.get_nowait()
-            to_see -= 1
+        sky_points = self.skyline.items
+        evicted = []
+        comparisons = 0
+        for idx in range(len(sky_points)):
+            cmp_tup = sky_points[idx]
+            comparisons += 1
 
             # if result is 1, remove the tuple from the window
             #
             # if result is -1, place the curTuple in the Non-skyline
             #
-            # if result is 0, place the curTuple in the 1) window,
-            # if place is there else in the temp file.
+            # if result is 0, keep the tuple in the skyline
             is_dom = self.check_dominated(point, cmp_tup)
             if is_dom == 1:
-                self.non_sky.put(cmp_tup)
-            elif is_dom == 0:
-                self.skyline.put(cmp_tup)
+                self.demote(cmp_tup, point)
+                evicted.append(cmp_tup)
             elif is_dom == -1:
-                self.skyline.put(cmp_tup)
-                self.non_sky.put(point)
+                self.demote(point, cmp_tup)
                 is_dominated = True
                 break
 
-        if not is_dominated:
+        # a dominated point can't have dominated anything before its
+        # dominator (the dominator would have dominated that too), so
+        # the skyline is unchanged and only the order might move
+        if is_dominated:
+            if MOVE_TO_FRONT and idx > 0:
+                self.skyline.move_to_front(idx)
+        else:
+            # only the evicted points and the new one change, so the
+            # step ring and coordinate index are only told about those
+            self.skyline.remove_points(evicted)
             self.skyline.put(point)
 
-        if RECORD_ALL:
-            entry = {'time': time.time(), 'sky_size': self.skyline.qsize(),
-                     'comparisons': (self.skyline.qsize() - to_see),
-                     'is_dom': is_dominated}
-            self.comp_size.write(json.dumps(entry) + "\n")
-            cur_sky = {'time': time.time(), 'is_dom': is_dominated,
-                       'comparisons': (self.skyline.qsize() - to_see),
-                       'skyline': self.get_sky_as_list()}
-            self.sky_file.write(json.dumps(cur_sky) + "\n")
+        self.comparisons = comparisons
         return not is_dominated
 
+    def track_steps(self, win_size):
+        """Keep the skyline and non-skyline points in per-step buckets
+        (a StepRing with win_size slots each), so that expire_steps can
+        drop whole steps and step_stats is cheap
+
+        """
+        self.skyline.track_steps(StepRing(win_size))
+        self.non_sky.track_steps(StepRing(win_size))
+        self.ledger = CreditLedger()
+
+    def expire_steps(self, oldest_step):
+        """Remove the skyline points with step <= oldest_step, and take
+        the credits for those steps back from the points that are left
+
+        Returns the expired points. Without step tracking, we have to
+        check the step of every skyline point
+
+        """
+        if self.skyline.ring is None:
+            expired = self.skyline.retain(
+                lambda item: self.settle(item, oldest_step))
+        else:
+            expired = self.skyline.ring.expire(oldest_step)
+            if len(expired) > 0:
+                self.skyline.remove_points(expired)
+        if self.ledger is not None:
+            self.ledger.expire(oldest_step)
+        for item in expired:
+            self.depart(item)
+        if self.metrics is not None:
+            self.metrics.incr('expired', len(expired))
+        return expired
+
+    def settle(self, item, oldest_step):
+        """Settle item's credits (see CreditLedger.settle) and return
+        True if it is still in the window
+
+        """
+        if self.ledger is not None:
+            self.ledger.settle(item, oldest_step)
+        return item.step > oldest_step
+
+    def step_stats(self):
+        """Return the number of skyline and non-skyline points alive in
+        each step (empty if we are not tracking steps)
+
+        """
+        stats = {'skyline': {}, 'non_sky': {}}
+        if self.skyline.ring is not None:
+            stats['skyline'] = self.skyline.ring.counts()
+        if self.non_sky.ring is not None:
+            stats['non_sky'] = self.non_sky.ring.counts()
+        return stats
+
+    def enlist(self, points):
+        """Take points with credits from another skyline into our ledger
+        (see CreditLedger.enlist), before they are merged into this one
+
+        """
+        if self.ledger is not None:
+            self.ledger.enlist(points)
+
+    def compact_candidates(self):
+        """Drop the non-skyline points that can never be promoted
+
+        A candidate can only be dropped for a point that was added
+        after the last compaction (removing points never makes another
+        one droppable), so we skip the pass over both stores when
+        neither of them has taken a point since. Returns the number of
+        points dropped
+
+        """
+        additions = (self.skyline.additions, self.non_sky.additions)
+        if additions == self.compacted:
+            return 0
+        dropped = self.non_sky.compact(self.skyline, self.check_dominated,
+                                       self.fold)
+        self.compacted = (self.skyline.additions, self.non_sky.additions)
+        if self.metrics is not None:
+            self.metrics.incr('compacted', dropped)
+        return dropped
+
     def reset_updates(self):
         self.updates = []
 
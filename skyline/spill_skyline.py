@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# spill_skyline.py: memory-bounded skyline. This is the window/tempFile
+# design from BasicSkyline.py: we keep at most a fixed number of
+# skyline points in memory (the window) and spill the rest to a file on
+# disk, which we read back through mmap and merge in block nested loop
+# passes
+
+
+# stdlib
+import itertools
+import json
+import mmap
+import struct
+import tempfile
+
+# local imports
+from constants import SPILL_BUDGET, SPILL_DIR
+from skyline import CreditLedger, Skyline, SkyPoint, SkyStore, StepRing
+from skyline import sfs_key
+
+# step, count, dominates, the synced count and dominates (-1 if the
+# master doesn't have the point, see SkyPoint.synced), number of
+# dimensions, length of the extra fields, and number of credits (see
+# skyline.CreditLedger)
+RECORD_HEADER = struct.Struct('<qqqqqHHH')
+
+
+def encode_point(point):
+    """Pack a point into a record for the spill file
+
+    The record is the header, one struct type code per dimension (q
+    for ints and d for floats, so the data comes back the same), the
+    data, the credits as (step, copies, dominated) int64s, and the
+    extra fields as JSON
+
+    """
+    types = "".join(['q' if isinstance(val, (int, long)) else 'd'
+                     for val in point.data])
+    extra = ""
+    if point.extra is not None:
+        extra = json.dumps(point.extra)
+    credits = []
+    if point.credits is not None:
+        credits = [[step] + entry
+                   for step, entry in sorted(point.credits.items())]
+    synced = point.synced
+    if synced is None:
+        synced = (-1, -1)
+    header = RECORD_HEADER.pack(point.step, point.count, point.dominates,
+                                synced[0], synced[1], len(point.data),
+                                len(extra), len(credits))
+    return (header + types + struct.pack('<' + types, *point.data) +
+            struct.pack('<{}q'.format(3 * len(credits)),
+                        *itertools.chain(*credits)) + extra)
+
+
+def decode_point(buf, offset):
+    """Unpack the record at offset in buf and return (point, next offset)"""
+    (step, count, dominates, synced_count, synced_dominates, dims,
+     extra_len, num_credits) = RECORD_HEADER.unpack_from(buf, offset)
+    offset += RECORD_HEADER.size
+    synced = None
+    if synced_count >= 0:
+        synced = (synced_count, synced_dominates)
+    types = buf[offset:offset + dims]
+    offset += dims
+    data = struct.unpack_from('<' + types, buf, offset)
+    offset += 8 * dims
+    credits = None
+    if num_credits > 0:
+        values = struct.unpack_from('<{}q'.format(3 * num_credits), buf,
+                                    offset)
+        credits = dict((values[idx], list(values[idx + 1:idx + 3]))
+                       for idx in range(0, len(values), 3))
+        offset += 24 * num_credits
+    extra = None
+    if extra_len > 0:
+        pairs = json.loads(buf[offset:offset + extra_len])
+        extra = tuple([tuple(pair) for pair in pairs])
+        offset += extra_len
+    return (SkyPoint(step, data, extra, count, dominates, credits, synced),
+            offset)
+
+
+class SpillFile():
+    """Append-only file of points that we read back through mmap
+
+    The file is a TemporaryFile, so it goes away on its own when it is
+    closed or the process exits
+
+    """
+
+    def __init__(self, directory=SPILL_DIR):
+        self.outf = tempfile.TemporaryFile(prefix='skyline-spill-',
+                                           dir=directory)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, points):
+        for point in points:
+            self.outf.write(encode_point(point))
+            self.count += 1
+
+    def __iter__(self):
+        if self.count == 0:
+            return
+        self.outf.flush()
+        buf = mmap.mmap(self.outf.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offset, size = 0, len(buf)
+            while offset < size:
+                point, offset = decode_point(buf, offset)
+                yield point
+        finally:
+            buf.close()
+
+    def close(self):
+        self.outf.close()
+
+
+class SpillStore(SkyStore):
+    """SkyStore that keeps up to budget points in memory (self.items)
+    and spills the rest to a SpillFile
+
+    Iterating, len, retain and drain cover both parts. put and replace
+    only touch the in-memory part; enforce_budget moves points to disk.
+    Points that come back from disk are new objects, so removing
+    points that are not in memory goes by equality (data and step)
+    instead of identity.
+
+    """
+
+    def __init__(self, budget=SPILL_BUDGET, items=None):
+        SkyStore.__init__(self, items=items)
+        self.budget = budget
+        self.spill = SpillFile()
+
+    def __iter__(self):
+        for item in self.items:
+            yield item
+        for item in self.spill:
+            yield item
+
+    def __len__(self):
+        return len(self.items) + len(self.spill)
+
+    def qsize(self):
+        return len(self)
+
+    def empty(self):
+        return len(self) == 0
+
+    def snapshot(self):
+        return list(self)
+
+    def rewrite_spill(self, keep):
+        """Rewrite the spill file with only the points where keep(point)
+        is true and return the points that were dropped
+
+        """
+        removed = []
+        if len(self.spill) == 0:
+            return removed
+        spill = SpillFile()
+        for item in self.spill:
+            if keep(item):
+                spill.append([item])
+            else:
+                removed.append(item)
+        self.spill.close()
+        self.spill = spill
+        return removed
+
+    def retain(self, keep):
+        removed = SkyStore.retain(self, keep)
+        removed.extend(self.rewrite_spill(keep))
+        return removed
+
+    def remove_points(self, points):
+        # the points that are in memory go by position, and only the
+        # rest (which came back from disk) need a pass by equality
+        rest = [point for point in points if id(point) not in self.pos]
+        SkyStore.remove_points(self, points)
+        if len(rest) > 0:
+            to_remove = set(rest)
+            self.retain(lambda item: item not in to_remove)
+
+    def drain(self):
+        items = SkyStore.drain(self)
+        items.extend(self.spill)
+        self.spill.close()
+        self.spill = SpillFile()
+        return items
+
+    def enforce_budget(self):
+        """Spill the in-memory points over the budget and return them
+
+        We keep the points with the smallest coordinate sums in memory
+        since they are the most likely to dominate new points
+
+        """
+        if len(self.items) <= self.budget:
+            return []
+        items = sorted(self.items, key=sfs_key)
+        spilled = items[self.budget:]
+        self.replace(items[:self.budget])
+        self.spill.append(spilled)
+        return spilled
+
+
+class SpillSkyline(Skyline):
+    """BNL skyline with a memory budget for the skyline window
+
+    New points are first checked against the in-memory window with the
+    regular BNL pass. The points from a batch that make it into the
+    window are then merged with the spilled points in a single pass
+    over the spill file: spilled points that they dominate are evicted
+    and the ones that are dominated by spilled points are pulled back
+    out of the skyline. After that, anything over the budget goes to
+    disk.
+
+    Note: candidates that depended on a spilled point lose their
+    dominator pointer (we don't keep spilled points in memory), so they
+    get another look on the next release. Only the window is indexed
+    for absorb_duplicate, so duplicates of spilled points are folded
+    in during the merge instead
+
+    The budget only bounds the skyline points in memory. The candidates
+    (non_sky) are all in memory, and so are the snapshots of the
+    skyline, which decode the whole spill file. Passes over the spill
+    file (the merge, expire_steps, step_stats, compact_candidates)
+    decode one record at a time, but each of them is a full read of
+    the file. Set the budget with the worker's --spill-budget
+
+    """
+
+    def __init__(self, skyline=None, non_sky=None, budget=SPILL_BUDGET):
+        Skyline.__init__(self, skyline=skyline, non_sky=non_sky)
+        if skyline is None:
+            self.skyline = SpillStore(budget=budget)
+
+    def update_sky_for_point(self, point):
+        return len(self.update_sky_for_points([point])) > 0
+
+    def update_sky_for_points(self, points):
+        """Update the skyline for a batch of points and return the points
+        from the batch that were added to the skyline
+
+        """
+        points = self.snap_points(points)
+        added = self.add_sorted(
+            sorted(points, key=sfs_key),
+            lambda point: Skyline.update_sky_for_point(self, point))
+        if len(added) > 0 and len(self.skyline.spill) > 0:
+            added = self.merge_spill(added)
+        self.spilled(self.skyline.enforce_budget())
+        return added
+
+    def spilled(self, points):
+        """Let go of points that went to disk (or back to it)
+
+        Their candidates get another look on every release from now on,
+        and are credited again to whatever dominates them then, so we
+        take them out of the spilled points' scores first
+
+        """
+        if self.ledger is not None:
+            for point in points:
+                for item in self.non_sky.dependents(point):
+                    self.ledger.withdraw(point, item)
+            self.ledger.forget(points)
+        self.non_sky.unlink(points)
+
+    def merge_spill(self, added):
+        """Check the points added to the window against the spill file
+        in one pass and return the ones that are still in the skyline
+
+        """
+        live = list(added)
+        dominated = set()
+
+        def keep(item):
+            is_dominator = False
+            for point in live:
+                if id(point) in dominated:
+                    continue
+                is_dom = self.check_dominated(point, item)
+                if is_dom != 0 and point.data == item.data:
+                    # fold the counts like absorb_duplicate does. The
+                    # spilled copy has no dependents to hand over
+                    if is_dom == 1:
+                        self.fold(point, item)
+                        return False
+                    self.fold(item, point)
+                    dominated.add(id(point))
+                    self.non_sky.transfer(point, item)
+                    is_dominator = True
+                    continue
+                if is_dom == 1:
+                    self.demote(item, point)
+                    return False
+                elif is_dom == -1:
+                    dominated.add(id(point))
+                    self.demote(point, item)
+                    is_dominator = True
+            if is_dominator:
+                # item goes back to disk, so let go of it before its
+                # record is written
+                self.spilled([item])
+            return True
+        self.skyline.rewrite_spill(keep)
+
+        # pull the window points that spilled points dominate back out
+        if len(dominated) > 0:
+            SkyStore.retain(self.skyline,
+                            lambda item: id(item) not in dominated)
+        return [point for point in live if id(point) not in dominated]
+
+    def track_steps(self, win_size):
+        # spilled points aren't in memory, so only the candidates go
+        # into per-step buckets and expire_steps scans the skyline
+        # (which settles the credits of the spilled points as well)
+        self.non_sky.track_steps(StepRing(win_size))
+        self.ledger = CreditLedger()
+
+    def step_stats(self):
+        # no buckets for the skyline here, so count by reading it
+        stats = Skyline.step_stats(self)
+        counts = stats['skyline']
+        for item in self.skyline:
+            counts[item.step] = counts.get(item.step, 0) + 1
+        return stats
+
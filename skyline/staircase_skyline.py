@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# staircase_skyline.py: skyline engine for 2-D points. A 2-D skyline
+# is a monotone staircase, so we keep it sorted and use binary search
+# instead of comparing against every skyline point
+
+# stdlib
+import bisect
+
+# local imports
+from constants import REMOVE_DUPS
+from skyline import Skyline, SkyStore, SkylineException
+
+
+class StaircaseStore(SkyStore):
+    """SkyStore that keeps 2-D points sorted by their coordinates
+
+    For a skyline (smaller is better), sorting by x also sorts y in
+    decreasing order. self.keys holds the (x, y) coordinates and
+    self.neg_ys holds -y, so both are in increasing order and can be
+    searched with bisect.
+
+    The searches are O(log n), but the lists are plain python lists,
+    so an insert or a removal shifts everything after it and is O(n).
+    That shift is a memmove of pointers in C, which is much cheaper
+    than the n python level comparisons of a BNL scan, but it is not
+    logarithmic. Removing many points at once rebuilds the lists in
+    one pass instead of shifting them once per point.
+
+    """
+
+    def __init__(self, items=None):
+        SkyStore.__init__(self)
+        self.keys = []
+        self.neg_ys = []
+        if items is not None:
+            self.replace(list(items))
+
+    def put(self, item):
+        key = item.data
+        if len(key) != 2:
+            raise SkylineException("staircase skyline only supports 2-D "
+                                   "points")
+        self.insert(bisect.bisect_right(self.keys, key), item)
+
+    def insert(self, idx, item):
+        """Insert the point at position idx (caller keeps the order)"""
+        key = item.data
+        self.items.insert(idx, item)
+        self.keys.insert(idx, key)
+        self.neg_ys.insert(idx, -key[1])
+        self.track_add(item)
+
+    def extend(self, items):
+        for item in items:
+            self.put(item)
+
+    def replace(self, items):
+        items = sorted(items, key=lambda item: item.data)
+        self.items = items
+        self.keys = [item.data for item in items]
+        self.neg_ys = [-key[1] for key in self.keys]
+        self.track_reset(items)
+
+    def remove_range(self, start, end):
+        """Remove the points in positions [start, end) and return them"""
+        removed = self.items[start:end]
+        del self.items[start:end]
+        del self.keys[start:end]
+        del self.neg_ys[start:end]
+        self.track_remove(removed)
+        return removed
+
+    def position(self, item):
+        idx = bisect.bisect_left(self.keys, item.data)
+        if idx < len(self.items) and self.items[idx] is item:
+            return idx
+        raise SkylineException("point is not in the store")
+
+    def swap(self, old, new):
+        # same coordinates, so new goes right where old was
+        self.items[self.position(old)] = new
+        self.track_remove([old])
+        self.track_add(new)
+
+    def remove_points(self, points):
+        """Remove the given points (matched by identity, points that
+        are not in the store are skipped)
+
+        """
+        found = set()
+        for point in points:
+            idx = bisect.bisect_left(self.keys, point.data)
+            if idx < len(self.items) and self.items[idx] is point:
+                found.add(idx)
+        if len(found) == 1:
+            idx = found.pop()
+            self.remove_range(idx, idx + 1)
+        elif len(found) > 1:
+            removed = [self.items[idx] for idx in sorted(found)]
+            kept = [idx for idx in range(len(self.items))
+                    if idx not in found]
+            self.items = [self.items[idx] for idx in kept]
+            self.keys = [self.keys[idx] for idx in kept]
+            self.neg_ys = [self.neg_ys[idx] for idx in kept]
+            self.track_remove(removed)
+
+    def retain(self, keep):
+        kept, removed = [], []
+        for item in self.items:
+            if keep(item):
+                kept.append(item)
+            else:
+                removed.append(item)
+        if len(removed) > 0:
+            self.replace(kept)
+        return removed
+
+    def drain(self):
+        items = self.items
+        self.items, self.keys, self.neg_ys = [], [], []
+        self.track_reset([])
+        return items
+
+
+class StaircaseSkyline(Skyline):
+    """Skyline for 2-D points that finds the dominator and the points
+    to evict with binary search instead of a scan
+
+    The only skyline point that can dominate a new point p is the one
+    just before p in (x, y) order, because it has the smallest y of
+    all the points with x <= p's x. The points that p dominates are a
+    contiguous run starting at p's position, ending at the first point
+    with y < p's y.
+
+    The binary searches make the dominance test O(log n), while the
+    insert and the eviction of the run are O(n) list shifts (see
+    StaircaseStore).
+
+    Note: this relies on the skyline being a staircase, which holds
+    as long as points are only added through update_sky_for_point or
+    come from a skyline computed elsewhere (like the master's)
+
+    """
+
+    def __init__(self, skyline=None, non_sky=None):
+        Skyline.__init__(self, skyline=skyline, non_sky=non_sky)
+        if skyline is None:
+            self.skyline = StaircaseStore()
+
+    def update_sky_for_point(self, point):
+        """Update the skyline for a new data point
+
+        Returns True if the point was added to the skyline
+
+        """
+        key = point.data
+        if len(key) != 2:
+            raise SkylineException("staircase skyline only supports 2-D "
+                                   "points")
+        store = self.skyline
+
+        # duplicates of a skyline point don't need a scan
+        absorbed = self.absorb_duplicate(point)
+        if absorbed is not None:
+            return absorbed
+
+        # check the point right before this one to see if it
+        # dominates us. Equal points fall back on the REMOVE_DUPS
+        # tie-break in check_dominated
+        is_dominated = False
+        prev = bisect.bisect_right(store.keys, key) - 1
+        if prev >= 0 and store.keys[prev][1] <= key[1]:
+            if store.keys[prev] != key:
+                is_dominated = True
+            elif REMOVE_DUPS:
+                is_dominated = point.step <= store.items[prev].step
+
+        if is_dominated:
+            self.demote(point, store.items[prev])
+            self.comparisons = 1
+            return False
+
+        # evict the run of points that have x >= our x and y >= our
+        # y. Without REMOVE_DUPS, equal points are incomparable, so we
+        # start after them
+        if REMOVE_DUPS:
+            start = bisect.bisect_left(store.keys, key)
+        else:
+            start = bisect.bisect_right(store.keys, key)
+        end = bisect.bisect_right(store.neg_ys, -key[1], start)
+        if end > start:
+            for item in store.remove_range(start, end):
+                self.demote(item, point)
+        store.insert(start, point)
+
+        self.comparisons = 1 + end - start
+        return True
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# test_parallel_skyline.py: check the counts of a windowed skyline that
+# is fed through the parallel prefilter against a brute force count of
+# the live copies. Run with python -m unittest discover from this
+# directory
+
+
+# stdlib
+import random
+import unittest
+
+# local imports
+import parallel_skyline
+from engines import make_skyline
+from parallel_skyline import ParallelFilter
+from skyline import SkyPoint
+
+
+class ParallelWindowTest(unittest.TestCase):
+
+    def setUp(self):
+        # small batches, so that every batch goes to the pool
+        self.min_batch = parallel_skyline.PARALLEL_MIN_BATCH
+        parallel_skyline.PARALLEL_MIN_BATCH = 1
+        self.parallel = ParallelFilter(2, engine='bnl', dims=2)
+
+    def tearDown(self):
+        self.parallel.close()
+        parallel_skyline.PARALLEL_MIN_BATCH = self.min_batch
+
+    def test_counts_are_live_copies(self):
+        rand = random.Random(3)
+        for trial in range(30):
+            win_size = rand.randint(1, 3)
+            steps = [[(rand.randint(0, 3), rand.randint(0, 3))
+                      for idx in range(rand.randint(0, 20))]
+                     for step in range(8)]
+            sky = make_skyline('bnl', dims=2, win_size=win_size)
+            for step in range(len(steps)):
+                oldest = step - win_size
+                expired = sky.expire_steps(oldest)
+                sky.compact_candidates()
+                batch = [SkyPoint(step, data) for data in steps[step]]
+                # released candidates come from older steps, so the
+                # prefilter sees batches that mix steps as well
+                batch.extend(item for item in sky.non_sky.release(expired)
+                             if item.step > oldest)
+                sky.update_sky_for_points(self.parallel.prefilter(batch))
+                live = {}
+                for old in range(max(0, oldest + 1), step + 1):
+                    for data in steps[old]:
+                        live[data] = live.get(data, 0) + 1
+                for point in sky.skyline:
+                    self.assertEqual(point.count, live[point.data],
+                                     (trial, step, point))
+
+
+if __name__ == "__main__":
+    unittest.main()
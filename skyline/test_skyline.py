@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# test_skyline.py: merge staged batches (like the worker's async_sync
+# mode) into windowed skylines and check the counts against a brute
+# force count of the live copies. Run with python -m unittest discover
+# from this directory
+
+
+# stdlib
+import random
+import unittest
+
+# local imports
+from engines import make_skyline
+from skyline import SkyPoint
+
+
+class StagedMergeTest(unittest.TestCase):
+
+    def replay(self, engine, rand):
+        win_size = rand.randint(2, 4)
+        sky = make_skyline(engine, dims=2, win_size=win_size)
+        history = []
+        for step in range(10):
+            oldest = step - win_size
+            expired = sky.expire_steps(oldest)
+            sky.compact_candidates()
+            sky.update_sky_for_points([item for item in
+                                       sky.non_sky.release(expired)
+                                       if item.step > oldest])
+            # a staged batch mixes steps, so its points take over
+            # credits from steps other than their own
+            batch = [(rand.choice([step, max(0, step - 1)]),
+                      (rand.randint(0, 3), rand.randint(0, 3)))
+                     for idx in range(rand.randint(0, 12))]
+            history.extend(batch)
+            staging = make_skyline(engine, dims=2, win_size=win_size)
+            staging.update_sky_for_points([SkyPoint(point_step, data)
+                                           for point_step, data in batch])
+            staged = staging.skyline.snapshot() + staging.non_sky.snapshot()
+            sky.enlist(staged)
+            sky.update_sky_for_points(staged)
+            live = {}
+            for point_step, data in history:
+                if point_step > oldest:
+                    live[data] = live.get(data, 0) + 1
+            for point in sky.skyline:
+                self.assertEqual(point.count, live[point.data],
+                                 (engine, step, point))
+
+    def test_counts_are_live_copies(self):
+        rand = random.Random(4)
+        for trial in range(100):
+            for engine in ['bnl', 'staircase', 'spill']:
+                self.replay(engine, rand)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# test_spill_skyline.py: replay random sliding windows through the
+# spill engine with tiny memory budgets and check it against the BNL
+# skyline. Run with python -m unittest discover from this directory
+
+
+# stdlib
+import random
+import unittest
+
+# local imports
+from skyline import Skyline, SkyPoint, WindowCandidates
+from spill_skyline import SpillSkyline
+
+
+def replay(sky, steps, win_size):
+    """Run the batches in steps through sky the way a worker does, and
+    return the skyline after each step as sorted (step, data, count)
+
+    """
+    skylines = []
+    for step in range(len(steps)):
+        oldest = step - win_size
+        expired = sky.expire_steps(oldest)
+        sky.compact_candidates()
+        if len(expired) > 0:
+            sky.update_sky_for_points([item for item in
+                                       sky.non_sky.release(expired)
+                                       if item.step > oldest])
+        sky.update_sky_for_points([SkyPoint(step, data, (('class', 'x'),))
+                                   for data in steps[step]])
+        skylines.append(sorted((point.step, point.data, point.count)
+                               for point in sky.skyline))
+    return skylines
+
+
+class SpillReplayTest(unittest.TestCase):
+
+    def test_matches_bnl(self):
+        rand = random.Random(5)
+        for trial in range(200):
+            dims = rand.choice([2, 3, 4])
+            win_size = rand.randint(1, 3)
+            # a few half values, so that records mix ints and doubles
+            steps = [[tuple(rand.choice([rand.randint(0, 6),
+                                         rand.randint(0, 6) + 0.5])
+                            for dim in range(dims))
+                      for idx in range(rand.randint(0, 30))]
+                     for step in range(6)]
+            ref = Skyline(non_sky=WindowCandidates())
+            ref.track_steps(win_size)
+            sky = SpillSkyline(non_sky=WindowCandidates(),
+                               budget=rand.randint(1, 4))
+            sky.track_steps(win_size)
+            self.assertEqual(replay(sky, steps, win_size),
+                             replay(ref, steps, win_size), trial)
+            self.assertTrue(len(sky.skyline.items) <= sky.skyline.budget)
+            for point in sky.skyline:
+                self.assertEqual(point.extra, (('class', 'x'),))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# test_wire.py: round trip random messages through each wire format and
+# compression. Run with python -m unittest discover from this directory
+
+
+# stdlib
+import random
+import unittest
+import zlib
+
+# local imports
+import wire
+from skyline import SkyPoint
+from wire import COMPRESS_LEVEL, CONTENT_TYPES, ENCODINGS, INT64_MAX
+from wire import INT64_MIN, JSON_TYPE, accepted_encoding, compress
+from wire import decode_message, decompress, encode_message
+
+
+def random_points(rand, size):
+    """Return size random points that share a number of dimensions and
+    a coordinate type (ints, doubles, or a mix like snapped points)
+
+    """
+    dims = rand.randint(1, 4)
+    kind = rand.choice(['int', 'float', 'mixed', 'big'])
+    extras = [None, (('class', 'normal.'),), (('class', 'smurf.'),
+                                               ('flag', 'SF'))]
+    points = []
+    for idx in range(size):
+        if kind == 'int':
+            data = [rand.randint(-1000, 1000) for dim in range(dims)]
+        elif kind == 'float':
+            data = [rand.uniform(-1e6, 1e6) for dim in range(dims)]
+        elif kind == 'mixed':
+            data = [rand.choice([0, rand.random()]) for dim in range(dims)]
+        else:
+            data = [rand.choice([INT64_MIN, INT64_MAX, -1])
+                    for dim in range(dims)]
+        points.append(SkyPoint(rand.randint(0, 100), data,
+                               rand.choice(extras), rand.randint(0, 5),
+                               rand.randint(0, 50)))
+    return points
+
+
+def fields(points):
+    return [(point.step, point.data, point.extra, point.count,
+             point.dominates) for point in points]
+
+
+class WireTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        rand = random.Random(7)
+        for trial in range(500):
+            message = {'step': rand.randint(0, 100), 'worker_id': 'a',
+                       'added': random_points(rand, rand.randint(0, 40)),
+                       'removed': random_points(rand, rand.randint(0, 5))}
+            if rand.random() < 0.5:
+                message['cube'] = dict(
+                    ("0,{}".format(dim),
+                     {'added': random_points(rand, rand.randint(0, 10)),
+                      'removed': []})
+                    for dim in range(1, rand.randint(1, 3)))
+            wire_format = rand.choice(sorted(CONTENT_TYPES))
+            body, content_type = encode_message(message, wire_format)
+            encoding = rand.choice(ENCODINGS + ['identity'])
+            if encoding != 'identity':
+                body = decompress(compress(body, encoding), encoding)
+            got = decode_message(body, content_type)
+            self.assertEqual(sorted(got), sorted(message), trial)
+            self.assertEqual(got['step'], message['step'], trial)
+            self.assertEqual(fields(got['added']),
+                             fields(message['added']), trial)
+            self.assertEqual(fields(got['removed']),
+                             fields(message['removed']), trial)
+            for key in message.get('cube', {}):
+                self.assertEqual(fields(got['cube'][key]['added']),
+                                 fields(message['cube'][key]['added']),
+                                 trial)
+
+    def test_without_numpy(self):
+        # the struct fallback reads the same points as the numpy views
+        rand = random.Random(11)
+        for trial in range(50):
+            message = {'added': random_points(rand, rand.randint(0, 20)),
+                       'removed': []}
+            body, content_type = encode_message(message, 'columns')
+            with_numpy = decode_message(body, content_type)
+            saved, wire.np = wire.np, None
+            try:
+                without = decode_message(body, content_type)
+            finally:
+                wire.np = saved
+            self.assertEqual(fields(without['added']),
+                             fields(with_numpy['added']), trial)
+            self.assertEqual(fields(without['added']),
+                             fields(message['added']), trial)
+
+    def test_json_fallback(self):
+        # coordinates that don't fit in an int64 go as JSON instead
+        huge = {'added': [SkyPoint(0, [2 ** 70, 1])], 'removed': []}
+        body, content_type = encode_message(huge, 'columns')
+        self.assertEqual(content_type, JSON_TYPE)
+        self.assertEqual(fields(decode_message(body, content_type)['added']),
+                         fields(huge['added']))
+
+    def test_encodings(self):
+        # raw deflate (no zlib header) is accepted too
+        raw = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED,
+                               -zlib.MAX_WBITS)
+        self.assertEqual(decompress(raw.compress("x" * 100) + raw.flush(),
+                                    'deflate'), "x" * 100)
+        self.assertEqual(accepted_encoding("deflate;q=1.0, gzip;q=0"),
+                         'deflate')
+        self.assertEqual(accepted_encoding("br"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
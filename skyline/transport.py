@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# transport.py: the worker's HTTP connection to the master. Requests go
+# over a pool of kept alive connections instead of a new connection
+# each, messages go in the format that both sides support, and big
+# bodies are compressed both ways (see wire.py)
+
+
+# stdlib
+import collections
+
+# non stdlib imports
+import requests
+from requests.adapters import HTTPAdapter
+
+# local imports
+from constants import COMPRESSION, SERVER_TIMEOUT, WIRE_FORMAT
+from skyline import SkylineException
+from wire import ENCODINGS, COMPRESS_MIN, CONTENT_TYPES, COLUMNS_TYPE
+from wire import JSON_TYPE, compress, decode_message, encode_message
+
+# constants
+# most connections that we keep open to the master (the worker has at
+# most a couple of requests in flight, see Exchange)
+POOL_SIZE = 4
+
+
+# what we know about each request: its name (like update_master), the
+# bytes of the body before and after compression, the bytes of the
+# response as it came over the wire, and the round trip time in seconds
+# (until the response's headers came back)
+Transfer = collections.namedtuple('Transfer', ['name', 'raw_sent', 'sent',
+                                               'received', 'rtt'])
+
+
+class Transport():
+    """Send requests to the master over a requests.Session
+
+    The session keeps the connections to the master alive between
+    requests. Responses come back compressed when the master can do it
+    (requests decompresses them for us), and bodies of at least
+    COMPRESS_MIN bytes are compressed with compression (gzip, deflate,
+    or None to send them as they are).
+
+    Messages (see wire.py) are sent in wire_format once the master has
+    told us that it supports it (see accept_formats), and we ask for
+    the responses in it with the Accept header.
+
+    Each request is recorded as a Transfer, which take_transfers hands
+    back (the exchange with the master can run in another thread, see
+    Worker.finish_exchange).
+
+    """
+
+    def __init__(self, master_url, compression=COMPRESSION,
+                 wire_format=WIRE_FORMAT, pool_size=POOL_SIZE):
+        if compression is not None and compression not in ENCODINGS:
+            raise SkylineException("unknown compression {}"
+                                   "".format(compression))
+        if wire_format not in CONTENT_TYPES:
+            raise SkylineException("unknown wire format {}"
+                                   "".format(wire_format))
+        self.master_url = master_url
+        self.compression = compression
+        self.wire_format = wire_format
+        # the format that we upload in, until the master tells us
+        # what it supports
+        self.upload_format = 'json'
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = ", ".join(ENCODINGS)
+        if wire_format == 'columns':
+            self.session.headers['Accept'] = "{}, {};q=0.5".format(
+                COLUMNS_TYPE, JSON_TYPE)
+        else:
+            self.session.headers['Accept'] = JSON_TYPE
+        self.transfers = []
+
+    def accept_formats(self, formats):
+        """Upload in our wire format if it is one of the master's
+        formats, and in JSON otherwise
+
+        """
+        self.upload_format = 'json'
+        if self.wire_format in formats:
+            self.upload_format = self.wire_format
+
+    def get(self, path, name=None, timeout=SERVER_TIMEOUT, **kwargs):
+        """GET path on the master and return the response"""
+        return self.request('GET', path, name, timeout=timeout, **kwargs)
+
+    def post_message(self, path, message, name=None, timeout=SERVER_TIMEOUT,
+                     **kwargs):
+        """POST message to path on the master and return the response"""
+        body, content_type = encode_message(message, self.upload_format)
+        headers = {'content-type': content_type}
+        raw_sent = len(body)
+        if self.compression is not None and raw_sent >= COMPRESS_MIN:
+            body = compress(body, self.compression)
+            headers['content-encoding'] = self.compression
+        return self.request('POST', path, name, data=body, headers=headers,
+                            raw_sent=raw_sent, timeout=timeout, **kwargs)
+
+    def request(self, method, path, name, data=None, raw_sent=0,
+                **kwargs):
+        req = self.session.request(method, self.master_url + path, data=data,
+                                   **kwargs)
+        sent = 0
+        if data is not None:
+            sent = len(data)
+        # the Content-Length is the size on the wire, before requests
+        # decompresses the response
+        received = req.headers.get('content-length')
+        if received is None:
+            received = len(req.content)
+        if name is None:
+            name = path.strip("/").split("/")[0]
+        self.transfers.append(Transfer(name, raw_sent, sent, int(received),
+                                       req.elapsed.total_seconds()))
+        return req
+
+    def read_message(self, req):
+        """Return the message in a response from the master"""
+        return decode_message(req.content, req.headers.get('content-type'))
+
+    def take_transfers(self):
+        """Return the requests made since the last call"""
+        transfers, self.transfers = self.transfers, []
+        return transfers
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# vector_skyline.py: skyline engine that keeps the skyline coordinates
+# in a contiguous numpy array and checks a new point against the whole
+# skyline with a single vectorized comparison
+
+
+# non stdlib imports
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# local imports
+from constants import REMOVE_DUPS
+from skyline import Skyline, SkyStore, SkylineException
+
+# constants
+INITIAL_CAPACITY = 64
+
+
+class ArraySkyStore(SkyStore):
+    """SkyStore that mirrors the coordinates and steps of its points in
+    numpy arrays
+
+    self.coords is a (capacity x dims) array and self.steps is a
+    (capacity) array, and only the first len(self.items) rows are
+    valid. The arrays grow by doubling, so a put is amortized O(1).
+
+    """
+
+    def __init__(self, items=None):
+        SkyStore.__init__(self)
+        self.coords = None
+        self.steps = None
+        if items is not None:
+            self.replace(list(items))
+
+    def dims(self):
+        if self.coords is None:
+            return None
+        return self.coords.shape[1]
+
+    def coords_view(self):
+        return self.coords[:len(self.items)]
+
+    def steps_view(self):
+        return self.steps[:len(self.items)]
+
+    def _reserve(self, dims, needed):
+        if self.coords is None:
+            capacity = max(INITIAL_CAPACITY, needed)
+            self.coords = np.empty((capacity, dims), dtype=np.float64)
+            self.steps = np.empty(capacity, dtype=np.int64)
+            return
+        if self.coords.shape[1] != dims:
+            raise SkylineException("data points have unequal dimensions")
+        capacity = self.coords.shape[0]
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        coords = np.empty((capacity, dims), dtype=np.float64)
+        steps = np.empty(capacity, dtype=np.int64)
+        count = len(self.items)
+        coords[:count] = self.coords[:count]
+        steps[:count] = self.steps[:count]
+        self.coords, self.steps = coords, steps
+
+    def put(self, item):
+        count = len(self.items)
+        self._reserve(len(item.data), count + 1)
+        self.coords[count] = item.data
+        self.steps[count] = item.step
+        SkyStore.put(self, item)
+
+    def extend(self, items):
+        for item in items:
+            self.put(item)
+
+    def replace(self, items):
+        # nothing in the old arrays needs to survive the resize
+        self.items = []
+        if len(items) > 0:
+            self._reserve(len(items[0].data), len(items))
+            count = len(items)
+            self.coords[:count] = [item.data for item in items]
+            self.steps[:count] = [item.step for item in items]
+        SkyStore.replace(self, items)
+
+    def remove_mask(self, mask):
+        """Remove the points whose entry in the boolean array mask is
+        True and return them as a list
+
+        """
+        removed = [self.items[idx] for idx in np.flatnonzero(mask)]
+        self.remove_points(removed)
+        return removed
+
+    def move(self, src, dst):
+        SkyStore.move(self, src, dst)
+        self.coords[dst] = self.coords[src]
+        self.steps[dst] = self.steps[src]
+
+    def swap(self, old, new):
+        idx = self.position(old)
+        SkyStore.swap(self, old, new)
+        self.steps[idx] = new.step
+
+    def retain(self, keep):
+        mask = np.array([not keep(item) for item in self.items], dtype=bool)
+        if not mask.any():
+            return []
+        return self.remove_mask(mask)
+
+    def drain(self):
+        return SkyStore.drain(self)
+
+
+class VectorSkyline(Skyline):
+    """Skyline that checks a new point against every skyline point at
+    once with numpy
+
+    This gives the same skyline as Skyline.update_sky_for_point,
+    including the REMOVE_DUPS tie-break on step, but replaces the per
+    point check_dominated calls with a handful of array operations
+
+    """
+
+    def __init__(self, skyline=None, non_sky=None):
+        if np is None:
+            raise SkylineException("the vector skyline engine requires "
+                                   "numpy")
+        Skyline.__init__(self, skyline=skyline, non_sky=non_sky)
+        if skyline is None:
+            self.skyline = ArraySkyStore()
+
+    def update_sky_for_point(self, point):
+        """Update the skyline for a new data point
+
+        Returns True if the point was added to the skyline
+
+        """
+        # add the tuple if there is nothing to compare to
+        if self.skyline.empty():
+            self.skyline.put(point)
+            self.comparisons = 0
+            return True
+
+        # duplicates of a skyline point don't need a scan
+        absorbed = self.absorb_duplicate(point)
+        if absorbed is not None:
+            return absorbed
+
+        data = np.asarray(point.data, dtype=np.float64)
+        coords = self.skyline.coords_view()
+        if data.shape[0] != coords.shape[1]:
+            raise SkylineException("data points have unequal dimensions")
+
+        # this mirrors check_dominated(point, sky_point) for every row:
+        # dominates is 1, dominated is -1
+        smaller = (data < coords).any(axis=1)
+        larger = (data > coords).any(axis=1)
+        dominates = smaller & ~larger
+        dominated = larger & ~smaller
+        if REMOVE_DUPS:
+            equal = ~(smaller | larger)
+            newer = point.step > self.skyline.steps_view()
+            dominates |= equal & newer
+            dominated |= equal & ~newer
+
+        # the scalar path stops at the first skyline point that
+        # dominates the new point, so only the points before that one
+        # are evicted
+        dominators = np.flatnonzero(dominated)
+        is_dominated = dominators.shape[0] > 0
+        if is_dominated:
+            first = dominators[0]
+            dominator = self.skyline.items[first]
+            dominates[first:] = False
+            comparisons = first + 1
+        else:
+            comparisons = coords.shape[0]
+
+        if dominates.any():
+            for item in self.skyline.remove_mask(dominates):
+                self.demote(item, point)
+        if is_dominated:
+            self.demote(point, dominator)
+        else:
+            self.skyline.put(point)
+
+        self.comparisons = int(comparisons)
+        return not is_dominated
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+#
+# Spring 2016
+#
+# wire.py: how the worker and master encode what they send each other
+# over HTTP. Messages (like the skyline changes for a step) go as JSON
+# or in a binary columnar format, and the bodies are compressed with
+# gzip or deflate when they are big enough to be worth it
+
+
+# stdlib
+import itertools
+import json
+import struct
+import zlib
+
+# non stdlib imports
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# local imports
+from skyline import SkyPoint, SkylineException
+from skyline import points_from_json, points_to_json
+
+# constants
+# the encodings that we can compress and decompress bodies with, in
+# order of preference
+ENCODINGS = ['gzip', 'deflate']
+# smallest body that we bother compressing (smaller ones fit in a
+# packet anyway)
+COMPRESS_MIN = 1024
+# zlib compression level. The bodies are mostly digits and repeated
+# keys, which compress well even at the fastest level
+COMPRESS_LEVEL = 1
+# the formats that messages can be sent in
+JSON_TYPE = 'application/json'
+COLUMNS_TYPE = 'application/x-skyline-columns'
+CONTENT_TYPES = {'json': JSON_TYPE, 'columns': COLUMNS_TYPE}
+# the keys of a message that hold lists of points (in the message and
+# in any dicts in it, like the changes for each subspace)
+POINT_LISTS = ('added', 'removed')
+# start of every columnar message (the last byte is the version)
+MAGIC = "SKC1"
+# integer coordinates that we can send as doubles without rounding
+MAX_EXACT_FLOAT = 2 ** 53
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+# the numpy types for the struct types in the columns (numpy's own
+# name for int64 comes back as python ints, rather than longs)
+NUMPY_TYPES = {'q': '<i8', 'd': '<f8', 'i': '<i4'}
+
+
+def compress(body, encoding):
+    """Return body compressed with encoding (gzip or deflate)"""
+    if encoding == 'gzip':
+        # a window of 16 + MAX_WBITS writes a gzip header and trailer
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        compressor = zlib.compressobj(COMPRESS_LEVEL)
+    else:
+        raise SkylineException("unknown encoding {}".format(encoding))
+    return compressor.compress(body) + compressor.flush()
+
+
+def decompress(body, encoding):
+    """Return body decompressed from encoding (gzip, deflate, or
+    identity)
+
+    """
+    encoding = encoding.strip().lower()
+    try:
+        if encoding == 'gzip':
+            return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        if encoding == 'deflate':
+            # deflate is supposed to have a zlib header, but some
+            # clients send raw deflate data
+            try:
+                return zlib.decompress(body)
+            except zlib.error:
+                return zlib.decompress(body, -zlib.MAX_WBITS)
+    except zlib.error as exp:
+        raise SkylineException("bad {} body: {}".format(encoding, exp))
+    if encoding in ('', 'identity'):
+        return body
+    raise SkylineException("unknown encoding {}".format(encoding))
+
+
+def accepted_encoding(accept):
+    """Return the encoding that we should compress a response with for
+    an Accept-Encoding header (None to leave it as it is)
+
+    """
+    if not accept:
+        return None
+    accepted = set()
+    for part in accept.split(","):
+        fields = part.strip().lower().split(";")
+        # an encoding with q=0 is one that the client refuses
+        params = [field.strip().replace(" ", "") for field in fields[1:]]
+        if any(param in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+               for param in params):
+            continue
+        accepted.add(fields[0].strip())
+    for encoding in ENCODINGS:
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def map_point_lists(message, convert):
+    """Return a copy of message with convert applied to each of its
+    lists of points
+
+    """
+    converted = {}
+    for key, value in message.items():
+        if key in POINT_LISTS:
+            value = convert(value)
+        elif isinstance(value, dict):
+            value = map_point_lists(value, convert)
+        converted[key] = value
+    return converted
+
+
+def encode_message(message, wire_format='json'):
+    """Return the body and content type for message (a dict whose
+    POINT_LISTS are lists of SkyPoints) in wire_format
+
+    A message that can't be sent in columns exactly (see
+    encode_columns) goes as JSON instead
+
+    """
+    if wire_format == 'columns':
+        try:
+            return encode_columns(message), COLUMNS_TYPE
+        except SkylineException:
+            pass
+    elif wire_format != 'json':
+        raise SkylineException("unknown wire format {}".format(wire_format))
+    return json.dumps(map_point_lists(message, points_to_json)), JSON_TYPE
+
+
+def decode_message(body, content_type):
+    """Return the message in body, whose lists of points come back as
+    SkyPoints
+
+    """
+    if content_type is not None:
+        content_type = content_type.split(";")[0].strip().lower()
+    if content_type == COLUMNS_TYPE:
+        return decode_columns(body)
+    try:
+        message = json.loads(body)
+    except ValueError:
+        raise SkylineException("message is not JSON")
+    if not isinstance(message, dict):
+        raise SkylineException("message is not a JSON object")
+    return map_point_lists(message, points_from_json)
+
+
+def encode_columns(message):
+    """Return message in the binary columnar format
+
+    The format is MAGIC, the length of a JSON header as a little endian
+    uint32, the header, and then the columns of each list of points.
+    The header has the message with each list of points replaced by
+    its index, and the size, number of dimensions, coordinate type, and
+    distinct extras of each list. The columns of a list are arrays of
+    little endian int64s with the step, count and dominates of each
+    point, then the coordinates, a dimension at a time (as int64s or
+    doubles), and then (if the points have extras) an int32 array with
+    the index of each point's extra. Everything starts on a multiple
+    of 8 bytes, so numpy can view the arrays right in the body.
+
+    Raises SkylineException if the coordinates can't be sent exactly
+    as int64s or doubles
+
+    """
+    lists = []
+
+    def collect(points):
+        lists.append(points)
+        return len(lists) - 1
+    skeleton = map_point_lists(message, collect)
+    infos = [column_info(points) for points in lists]
+    header = json.dumps({'message': skeleton, 'lists': infos})
+    parts = [MAGIC, struct.pack('<I', len(header)), header,
+             padding(len(MAGIC) + 4 + len(header))]
+    try:
+        for points, info in zip(lists, infos):
+            parts.extend(pack_columns(points, info))
+    except struct.error as exp:
+        raise SkylineException("can't pack points: {}".format(exp))
+    return "".join(parts)
+
+
+def column_info(points):
+    """Return the header entry for a list of points"""
+    dims = 0
+    if len(points) > 0:
+        dims = len(points[0].data)
+    values = []
+    for point in points:
+        if len(point.data) != dims:
+            raise SkylineException("data points have unequal dimensions")
+        values.extend(point.data)
+    ints = [value for value in values if isinstance(value, (int, long))]
+    if len(ints) == len(values):
+        if len(ints) > 0 and (min(ints) < INT64_MIN or
+                              max(ints) > INT64_MAX):
+            raise SkylineException("coordinates do not fit in an int64")
+        coord_type = 'q'
+    else:
+        if len(ints) + sum(1 for value in values
+                           if isinstance(value, float)) != len(values):
+            raise SkylineException("coordinates are not all numbers")
+        # a few ints among doubles (like the 0s of snapped points)
+        if len(ints) > 0 and max(abs(value)
+                                 for value in ints) > MAX_EXACT_FLOAT:
+            raise SkylineException("coordinates do not fit in a double")
+        coord_type = 'd'
+    extras = sorted(set(point.extra for point in points))
+    if extras == [None]:
+        extras = []
+    return {'size': len(points), 'dims': dims, 'type': coord_type,
+            'extras': extras}
+
+
+def padding(length):
+    return "\0" * (-length % 8)
+
+
+def pack_columns(points, info):
+    """Return the columns of a list of points, as a list of strings"""
+    size = len(points)
+    if size == 0:
+        return []
+    ints = '<{}q'.format(size)
+    parts = [struct.pack(ints, *[point.step for point in points]),
+             struct.pack(ints, *[point.count for point in points]),
+             struct.pack(ints, *[point.dominates for point in points])]
+    coords = zip(*[point.data for point in points])
+    parts.append(struct.pack('<{}{}'.format(size * info['dims'],
+                                            info['type']),
+                             *itertools.chain(*coords)))
+    if len(info['extras']) > 0:
+        index = dict((extra, pos)
+                     for pos, extra in enumerate(info['extras']))
+        parts.append(struct.pack('<{}i'.format(size),
+                                 *[index[point.extra] for point in points]))
+        parts.append(padding(4 * size))
+    return parts
+
+
+def decode_columns(body):
+    """Return the message in a body from encode_columns"""
+    if body[:len(MAGIC)] != MAGIC:
+        raise SkylineException("not a columnar message")
+    try:
+        offset = len(MAGIC) + 4
+        length = struct.unpack_from('<I', body, len(MAGIC))[0]
+        header = json.loads(body[offset:offset + length])
+        offset += length
+        offset += len(padding(offset))
+        lists = []
+        for info in header['lists']:
+            points, offset = unpack_columns(body, offset, info)
+            lists.append(points)
+        if offset != len(body):
+            raise SkylineException("columnar message has {} extra bytes"
+                                   "".format(len(body) - offset))
+        return map_point_lists(header['message'], lists.__getitem__)
+    except (struct.error, ValueError, KeyError, IndexError,
+            TypeError) as exp:
+        raise SkylineException("bad columnar message: {}".format(exp))
+
+
+def read_array(body, offset, code, count):
+    """Return count values of struct type code from body at offset, and
+    the offset after them
+
+    With numpy, the values are a read-only array that views body in
+    place, so nothing is copied until the caller turns them into python
+    numbers (with as_list, or in one go with the other columns). Without
+    numpy, they are a tuple from struct.
+
+    """
+    end = offset + 8 * count
+    if code == 'i':
+        end = offset + 4 * count
+    if end > len(body):
+        raise SkylineException("columnar message is cut short")
+    if np is not None:
+        values = np.frombuffer(body, dtype=NUMPY_TYPES[code], count=count,
+                               offset=offset)
+    else:
+        values = struct.unpack_from('<{}{}'.format(count, code), body,
+                                    offset)
+    return values, end
+
+
+def as_list(values):
+    """Return the values from read_array as a list of python numbers"""
+    if np is not None:
+        return values.tolist()
+    return list(values)
+
+
+def unpack_columns(body, offset, info):
+    """Return the points of a list from body at offset (see
+    pack_columns), and the offset after them
+
+    """
+    size, dims = info['size'], info['dims']
+    if size == 0:
+        return [], offset
+    steps, offset = read_array(body, offset, 'q', size)
+    counts, offset = read_array(body, offset, 'q', size)
+    dominates, offset = read_array(body, offset, 'q', size)
+    coords, offset = read_array(body, offset, info['type'], size * dims)
+    if dims == 0:
+        data = [()] * size
+    elif np is not None:
+        # the dimensions are rows of the view, and one tolist turns
+        # them into python numbers
+        data = zip(*coords.reshape(dims, size).tolist())
+    else:
+        data = zip(*[coords[dim * size:(dim + 1) * size]
+                     for dim in range(dims)])
+    if len(info['extras']) > 0:
+        # JSON turned the (name, value) pairs into lists
+        extras = [None if extra is None else
+                  tuple(tuple(pair) for pair in extra)
+                  for extra in info['extras']]
+        index, offset = read_array(body, offset, 'i', size)
+        offset += len(padding(4 * size))
+        extras = map(extras.__getitem__, as_list(index))
+    else:
+        extras = [None] * size
+    return (map(SkyPoint, as_list(steps), data, extras, as_list(counts),
+                as_list(dominates)), offset)
+
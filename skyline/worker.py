@@ -20,20 +20,30 @@ import logging
 import random
 import string
 import sys
+import threading
 import time
 
 
 # non stdlib imports
-import requests
 import line_profiler
 
 # local imports
 from constants import WORKER_REQUERIES, WORKER_MASTER_WAIT, SERVER_TIMEOUT
-from constants import SERVER_REQUERIES, RECORD_ALL
-from skyline import Skyline
+from constants import SERVER_REQUERIES, SKY_ENGINE, METRICS_FILE
+from constants import LONG_POLL_WAIT, COMPRESSION, WIRE_FORMAT, DISCRETE_CARDS
+from constants import SPILL_BUDGET
+from engines import make_skyline
+from ingest import ColumnParser, MappedReader, ReadAhead, read_blocks
+from metrics import Metrics
+from parallel_skyline import ParallelFilter
+from skycube import SkyCube, parse_subspaces
+from skyline import SkyPoint
+from transport import Transport
 
 # constants
 UPLOAD_WAIT = 5
+# most entries that we will buffer before updating the skyline
+MAX_BATCH = 50000
 
 
 def create_nonce(length):
@@ -42,9 +52,9 @@ def create_nonce(length):
     return nonce
 
 
-def process_line(line):
-    entry = json.loads(line)
-    entry['data'] = tuple(entry['data'])
+def proc_json(line):
+    """Process a line with a JSON point like {"step": 0, "data": [1, 2]}"""
+    return SkyPoint.from_json(json.loads(line))
 
 
 def proc_dur_count(line):
@@ -54,16 +64,22 @@ def proc_dur_count(line):
     that may be under a DOS
 
     """
-    parts = line.split(",")
+    parts = line.rstrip("\r\n").split(",")
     dur, count = int(parts[0]), int(parts[22])
     # we are now looking for the minimum duration and the max count,
     # so subtract from the max count value
     min_cnt = 1000 - count
-    item = {'step': 0, 'data': tuple([dur, min_cnt]), 'dur': dur,
-            'count': count, 'class': parts[-1]}
+    data = (dur, min_cnt)
+    extra = tuple(sorted(dur_count_fields(data) + (('class', parts[-1]),)))
+    item = SkyPoint(0, data, extra=extra)
     return item
 
 
+def dur_count_fields(data):
+    """Return the dur and count fields of a dur_count point"""
+    return (('count', 1000 - data[1]), ('dur', data[0]))
+
+
 def proc_dur_srv_count(line):
     """Process the line and extract the duration and srv_count
 
@@ -71,21 +87,106 @@ def proc_dur_srv_count(line):
     from a dos
 
     """
-    parts = line.split(",")
+    parts = line.rstrip("\r\n").split(",")
     dur, srv = int(parts[0]), int(parts[23])
     # we are now looking for the minimum duration and the max count,
     # so subtract from the max count value
     srv = 1000 - srv
-    item = {'step': 0, 'data': tuple([dur, srv]), 'dur': dur, 'srv_cnt': srv,
-            'class': parts[-1]}
+    data = (dur, srv)
+    extra = tuple(sorted(dur_srv_count_fields(data) +
+                         (('class', parts[-1]),)))
+    item = SkyPoint(0, data, extra=extra)
+    return item
+
+
+def dur_srv_count_fields(data):
+    """Return the dur and srv_cnt fields of a dur_srv_count point"""
+    return (('dur', data[0]), ('srv_cnt', data[1]))
+
+
+def proc_dur_counts(line):
+    """Process the line and extract the duration, count, and srv_count
+
+    Note: this is meant for skycubes (see skycube.py), so that the
+    skylines over any pair of these come from a single worker run
+
+    """
+    parts = line.rstrip("\r\n").split(",")
+    dur, count, srv = int(parts[0]), int(parts[22]), int(parts[23])
+    item = SkyPoint(0, (dur, 1000 - count, 1000 - srv),
+                    extra=(('class', parts[-1]),))
     return item
 
 
+# line formats that we know how to read
+LINE_FORMATS = {'json': proc_json, 'dur_count': proc_dur_count,
+                'dur_srv_count': proc_dur_srv_count,
+                'dur_counts': proc_dur_counts}
+# the same formats, parsed a block of lines at a time (see ingest.py)
+BLOCK_FORMATS = {'dur_count': ColumnParser([0, 22], flip={1: 1000},
+                                           fields=dur_count_fields),
+                 'dur_srv_count': ColumnParser([0, 23], flip={1: 1000},
+                                               fields=dur_srv_count_fields),
+                 'dur_counts': ColumnParser([0, 22, 23],
+                                            flip={1: 1000, 2: 1000})}
+
+
+class Exchange():
+    """Upload a step's changes to the master and get its reply in a
+    background thread
+
+    The thread only talks to the master (see Worker.send_upload and
+    Worker.fetch_master_updates), so the worker can keep updating its
+    staging skylines in the meantime. The upload is encoded in the
+    thread, from the points themselves, which is fine since the real
+    skylines don't change until the exchange is done (see
+    Worker.finish_exchange). Exceptions are raised by wait.
+
+    """
+
+    def __init__(self, worker, upload):
+        self.data = None
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self.thread = threading.Thread(target=self.run,
+                                       args=(worker, upload))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, worker, upload):
+        try:
+            worker.send_upload(upload)
+            self.data = worker.fetch_master_updates()
+        except Exception:
+            self.error = sys.exc_info()
+        self.finished = time.time()
+
+    def done(self):
+        return not self.thread.is_alive()
+
+    def wait(self):
+        """Return the master's reply, once we have it"""
+        self.thread.join()
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.data
+
+
 class Worker():
-    def __init__(self, infile, master, process_line=None, work_id=None):
+    def __init__(self, infile, master, process_line=None, work_id=None,
+                 engine=SKY_ENGINE, procs=1, partition='angle',
+                 metrics_file=METRICS_FILE, parser=None, mmap_input=False,
+                 read_ahead=0, async_sync=False, long_poll=True,
+                 compression=COMPRESSION, wire_format=WIRE_FORMAT,
+                 spill_budget=SPILL_BUDGET):
         self.infile = infile
         self.inputf = open(infile, 'r')
         self.master_url = master
+        # everything we send to the master goes over the same pool of
+        # connections
+        self.transport = Transport(master, compression=compression,
+                                   wire_format=wire_format)
 
         if work_id is not None:
             self.worker_id = work_id
@@ -105,23 +206,84 @@ class Worker():
         # logging.getLogger('').setLevel(logging.DEBUG)
         # self.logger = logging.getLogger(self.worker_id)
 
-        self.process_line = json.loads
+        self.process_line = proc_json
         if process_line is not None:
             self.process_line = process_line
+        # if given, parser (a ColumnParser) turns a whole block of
+        # lines into points and we only use process_line to peek at the
+        # first line. With mmap_input, the parser's columns are read
+        # straight out of a memory map of the input
+        self.parser = parser
+        self.mmap_input = mmap_input
+        # how many blocks a background thread can read and parse ahead
+        # of the skyline updates (0 to read them as we go)
+        self.read_ahead = read_ahead
+        # with async_sync, the exchange with the master at the end of
+        # a step runs in the background while the next step's points
+        # go into the staging skylines (see start_staging)
+        self.async_sync = async_sync
+        self.exchange = None
+        self.staging = None
+        self.staging_cube = None
+        # ask the master to answer as soon as each step is done (or
+        # fall back to sleeping and polling, for masters without it)
+        self.long_poll = long_poll
 
         # verify that we can actually talk to the master by trying to
         # get information about the step size
         self.verify_master()
 
         # create the skyline stuff
-        self.sky = Skyline()
-        self.old_skys = {}
+        self.engine = engine
+        # most skyline points that the spill engine keeps in memory
+        self.spill_budget = spill_budget
+        self.metrics = None
+        if metrics_file is not None:
+            self.metrics = Metrics.open(metrics_file, name=self.worker_id)
+        dims = self.peek_dims()
+        self.dims = dims
+        self.sky = make_skyline(engine, dims=dims, win_size=self.win_size,
+                                metrics=self.metrics, epsilon=self.epsilon,
+                                cards=self.cards, budget=spill_budget)
+        # the points we sent in the last upload in top k mode (what
+        # the master has of each point is in SkyPoint.synced)
+        self.uploaded = None
+
+        # the skylines of the subspaces that the master asked for, which
+        # we update from the same batches as the full skyline
+        self.cube = None
+        subspaces = parse_subspaces(self.subspaces, dims)
+        if len(subspaces) > 0:
+            self.cube = SkyCube(subspaces, engine=engine,
+                                win_size=self.win_size, epsilon=self.epsilon,
+                                cards=self.cards, budget=spill_budget)
+
+        # with more than one process, prefilter each step's batch across
+        # a process pool before it reaches our skyline
+        self.parallel = None
+        if procs > 1:
+            self.parallel = ParallelFilter(procs, engine=engine, dims=dims,
+                                           partition=partition,
+                                           epsilon=self.epsilon,
+                                           cards=self.cards)
+
+    def peek_dims(self):
+        """Return the number of dimensions of the first point in the
+        input (or None if the input is empty) without consuming it
+
+        """
+        pos = self.inputf.tell()
+        line = self.inputf.readline()
+        self.inputf.seek(pos)
+        if not line:
+            return None
+        return len(self.process_line(line).data)
 
     def verify_master(self):
         """Verify the location of the master and get the time step and size
 
         """
-        req = requests.get(self.master_url + "/step", timeout=SERVER_TIMEOUT)
+        req = self.transport.get("/step", timeout=SERVER_TIMEOUT)
         req.raise_for_status()
         entry = req.json()
         self.step = entry['step']
@@ -130,6 +292,16 @@ class Worker():
         self.start_time = entry['start_time']
         self.window_start = entry['window_time']
         self.window_end = self.window_start + self.step_size
+        # the master decides if the skyline is approximate and if we
+        # only send it the top k representatives
+        self.epsilon = entry.get('epsilon')
+        self.top_k = entry.get('top_k')
+        self.subspaces = entry.get('subspaces')
+        # and the number of values of each dimension, if they are
+        # small integers (see bitmap_skyline.py)
+        self.cards = entry.get('cards', DISCRETE_CARDS)
+        # masters from before the columnar format only take JSON
+        self.transport.accept_formats(entry.get('wire_formats', ['json']))
         self.logger.info("Checked in with the master and got {}".format(entry))
 
     def run(self):
@@ -139,47 +311,197 @@ class Worker():
         """
         print ("Worker is now running at step {} with step_size {} starting "
                "at time {}".format(self.step, self.step_size, self.start_time))
-        # read in the entries for this step
-        processed, last_proc = 0, 0
-        if RECORD_ALL:
-            self.sky_size = open('skyline-size.json', 'w')
-            self.sky.comp_size = open('sky-comp-size.json', 'w')
-            self.sky.sky_file = open('sky-file.json', 'w')
-        for line in self.inputf.xreadlines():
-            entry = self.process_line(line)
-
-            processed += 1
-            last_proc += 1
-            if (processed % 1000) == 0:
-                self.logger.info("Processed {} total entries ({} after last "
-                                 "step)".format(processed, last_proc))
-                # write out skyline size if necessary
-                if RECORD_ALL:
-                    item = {'time': time.time(), 'num_entry': processed,
-                            'sky_size': self.sky.skyline.qsize()}
-                    self.sky_size.write(json.dumps(item) + "\n")
-                    self.sky_size.flush()
-
-            # if we are moving beyond this timestep, then wait for
-            # more data from the master
-            if entry['step'] > self.step:
-                self.upload_data()
-                self.logger.debug("Starting to wait on upload for {}"
-                                  "".format(UPLOAD_WAIT))
-                time.sleep(UPLOAD_WAIT)
-                self.get_master_updates()
-                last_proc = 0
-
-            # now update the skyline using this point
-            self.update_skyline(entry)
+        # read in the entries, a block at a time
+        blocks = self.read_points()
+        ahead = None
+        if self.read_ahead > 0:
+            ahead = ReadAhead(blocks, depth=self.read_ahead)
+            blocks = ahead
+        try:
+            self.process_blocks(blocks, ahead)
+        finally:
+            if ahead is not None:
+                ahead.close()
+                self.logger.info("Read ahead: {}".format(ahead.stats()))
         self.inputf.close()
-        if RECORD_ALL:
-            self.sky_size.close()
-            self.sky.comp_size.close()
-            self.sky.sky_file.close()
+        if self.parallel is not None:
+            self.parallel.close()
         self.upload_data()
-        req = requests.get(self.master_url + "/worker_done")
+        req = self.transport.get("/worker_done",
+                                 params={'worker_id': self.worker_id})
         req.raise_for_status()
+        self.record_transfers()
+        self.transport.close()
+        if self.metrics is not None:
+            self.metrics.close()
+
+    def process_blocks(self, blocks, ahead=None):
+        """Update the skyline with blocks of points, syncing with the
+        master at the end of every step
+
+        ahead is the ReadAhead that the blocks come from, if any, whose
+        queue we keep an eye on
+
+        """
+        processed, last_proc = 0, 0
+        batch = []
+        for points in blocks:
+            processed += len(points)
+
+            # most blocks are all from the current step, so we only go
+            # through the points one at a time when a block crosses
+            # into a later step
+            while len(points) > 0 and points[-1].step > self.reading_step():
+                step = self.reading_step()
+                end = 0
+                while points[end].step <= step:
+                    end += 1
+                # we are moving beyond this timestep, so update the
+                # skyline with this step's entries and wait for more
+                # data from the master
+                batch.extend(points[:end])
+                self.end_step(batch)
+                batch = [points[end]]
+                points = points[end + 1:]
+                last_proc = 1
+
+            last_proc += len(points)
+            self.logger.info("Processed {} total entries ({} after last "
+                             "step)".format(processed, last_proc))
+            if ahead is not None:
+                self.record_read_ahead(ahead)
+
+            # buffer the points so that we can update the skyline with
+            # the whole step at once. While an exchange with the master
+            # is in flight, they go straight to the staging skylines
+            batch.extend(points)
+            if len(batch) >= MAX_BATCH or self.staging is not None:
+                self.update_skyline_batch(batch)
+                batch = []
+            if self.exchange is not None and self.exchange.done():
+                self.finish_exchange()
+        self.finish_exchange()
+        self.update_skyline_batch(batch)
+
+    def reading_step(self):
+        """Return the step whose points we are reading, which is one
+        past self.step while the exchange with the master for self.step
+        is in flight
+
+        """
+        if self.exchange is not None:
+            return self.step + 1
+        return self.step
+
+    def record_read_ahead(self, ahead):
+        """Record how full the read ahead queue is
+
+        A queue that is usually empty means that we are waiting on
+        reading and parsing, and one that is usually full means that
+        the skyline updates are what holds us back
+
+        """
+        occupancy = ahead.occupancy()
+        self.logger.debug("Read ahead queue has {} of {} blocks"
+                          "".format(occupancy, ahead.depth))
+        if self.metrics is not None:
+            self.metrics.observe('read_ahead', occupancy)
+            self.metrics.gauge('ingest_waits', ahead.empty_waits)
+            self.metrics.gauge('compute_waits', ahead.full_waits)
+
+    def read_points(self):
+        """Yield the points from the input a block of lines at a time"""
+        if self.parser is not None and self.mmap_input:
+            for points in MappedReader(self.inputf, self.parser).blocks():
+                yield points
+            return
+        for lines in read_blocks(self.inputf):
+            if self.parser is not None:
+                yield self.parser.parse(lines)
+            else:
+                yield map(self.process_line, lines)
+
+    def end_step(self, batch):
+        """Update the skyline with the rest of the step's points, sync
+        with the master, and move on to the next step
+
+        In async_sync mode, we only start the exchange with the master
+        here, and the next step's points are staged until it is done
+        (see finish_exchange). The previous step's exchange has to be
+        done first, so we are never more than one step ahead.
+
+        """
+        self.finish_exchange()
+        self.update_skyline_batch(batch)
+        if self.metrics is not None:
+            self.metrics.incr('steps')
+            self.metrics.sizes(self.sky)
+            self.metrics.maybe_export()
+        if self.async_sync:
+            self.exchange = Exchange(self, self.make_upload())
+            self.start_staging()
+            return
+        self.upload_data()
+        self.get_master_updates()
+
+    def start_staging(self):
+        """Start new staging skylines for the points of the next step
+
+        While the master has not sent back its changes for the last
+        step, we can't update our skylines, but we can already run the
+        next step's points against each other: under the window, a
+        point that is dominated by a point from the same step can never
+        reach the skyline, so only what is left of the step has to be
+        merged once the master's changes are in. The staging skylines
+        are exact (the points are snapped when they are merged).
+
+        """
+        self.staging = make_skyline(self.engine, dims=self.dims,
+                                    win_size=self.win_size, epsilon=None,
+                                    cards=self.cards,
+                                    budget=self.spill_budget)
+        if self.cube is not None:
+            self.staging_cube = SkyCube(self.cube.subspaces.values(),
+                                        engine=self.engine,
+                                        win_size=self.win_size, epsilon=None,
+                                        cards=self.cards,
+                                        budget=self.spill_budget)
+
+    def finish_exchange(self):
+        """Wait for the exchange with the master that is in flight (if
+        any), apply the master's changes, and merge the staged points
+        into our skylines
+
+        """
+        if self.exchange is None:
+            return
+        exchange, self.exchange = self.exchange, None
+        before = time.time()
+        data = exchange.wait()
+        blocked = time.time() - before
+        staging, self.staging = self.staging, None
+        staging_cube, self.staging_cube = self.staging_cube, None
+        self.apply_master_updates(data)
+
+        staged = staging.skyline.snapshot() + staging.non_sky.snapshot()
+        self.logger.debug("Exchange took {:.3f}s, merging {} staged "
+                          "points".format(exchange.finished -
+                                          exchange.started, len(staged)))
+        # the staged points can hold credits from other steps, which
+        # our ledgers have to know about to take them back on expiry
+        self.sky.enlist(staged)
+        self.update_skyline_batch(staged, cube=False)
+        if staging_cube is not None:
+            for key in self.cube.keys():
+                sky = staging_cube.skys[key]
+                points = sky.skyline.snapshot() + sky.non_sky.snapshot()
+                self.cube.skys[key].enlist(points)
+                self.cube.skys[key].update_sky_for_points(points)
+        if self.metrics is not None:
+            self.metrics.incr('staged', len(staged))
+            # how long we still had to wait on the master after
+            # running out of things to do
+            self.metrics.observe('exchange_wait', blocked)
 
     def upload_data(self):
         """Upload the changes to the skyline to the master node
@@ -190,22 +512,30 @@ class Worker():
         2) send data to master
 
         """
+        self.send_upload(self.make_upload())
+
+    def make_upload(self):
+        """Return the changes to send to the master for this step"""
         self.logger.debug("Starting to upload data")
         # find the difference in old and new skyline (skyline updates
         # to send to master
         added, removed = self.find_skyline_diff()
 
-        url = self.master_url + "/update_master"
-        headers = {'content-type': 'application/json'}
-        params = {'worker_id': self.worker_id}
-        upload_data = {'step': self.step, 'added': added, 'removed': removed,
-                       'worker_id': self.worker_id}
+        upload_data = {'step': self.step, 'added': added,
+                       'removed': removed, 'worker_id': self.worker_id}
+        if self.cube is not None:
+            upload_data['cube'] = self.find_cube_diff()
+        return upload_data
 
+    def send_upload(self, upload_data):
+        """Send the changes from make_upload to the master"""
+        params = {'worker_id': self.worker_id}
         self.logger.debug("Preparing to upload: {}".format(upload_data))
         # upload the data, but make sure that we try several times on failure
         for x in range(SERVER_REQUERIES):
-            req = requests.post(url, timeout=SERVER_TIMEOUT, headers=headers,
-                                data=json.dumps(upload_data), params=params)
+            req = self.transport.post_message("/update_master", upload_data,
+                                              timeout=SERVER_TIMEOUT,
+                                              params=params)
             # self.logger.debug("Sent upload data to {}".format(url))
             if req.status_code == 200:
                 break
@@ -215,44 +545,96 @@ class Worker():
         req.raise_for_status()
 
     def find_skyline_diff(self):
-        # first compute the new skyline's set
-        skys = {}
-        to_see = self.sky.skyline.qsize()
-        # while not self.sky.skyline.empty():
-        for x in range(to_see):
-            item = self.sky.skyline.get_nowait()
-            step = tuple([item['step']])
-            key = tuple(item['data']) + step
-            skys[key] = item
-            self.sky.skyline.put(item)
-        new_keys = set(skys.keys())
-        old_keys = set(self.old_skys.keys())
-        added = new_keys - old_keys
-        removed = old_keys - new_keys
-        added = map(lambda x: skys[x], added)
-        removed = map(lambda x: self.old_skys[x], removed)
+        added, removed, self.uploaded = self.diff_skyline(self.sky)
         self.logger.debug("Skyline diff- added: {} removed: {}"
                           "".format(added, removed))
         return added, removed
 
+    def find_cube_diff(self):
+        """Return the changes to each subspace skyline since the last
+        sync, keyed by subspace
+
+        """
+        cube = {}
+        for key in self.cube.keys():
+            added, removed, self.cube.uploaded[key] = self.diff_skyline(
+                self.cube.skys[key])
+            cube[key] = {'added': added, 'removed': removed}
+        return cube
+
+    def diff_skyline(self, sky):
+        """Return the points added to and removed from sky since we
+        synced it with the master, and the points we will have uploaded
+        in top k mode (None otherwise)
+
+        This is a pass over the skyline, which reads the spill file in
+        place for the spill engine, plus the points that have left it
+        since (see Skyline.depart), so we don't hold a copy of the
+        skyline between steps
+
+        """
+        # in top k mode, only the representatives go to the master
+        shown = None
+        if self.top_k is not None:
+            shown = set(sky.representatives(self.top_k))
+        departed = dict((point, point) for point in sky.take_departed())
+        added, removed = [], []
+        for point in sky.skyline:
+            # a point that left and came back is still at the master
+            gone = departed.pop(point, None)
+            if gone is not None and point.synced is None:
+                point.synced = gone.synced
+            if shown is not None and point not in shown:
+                if point.synced is not None:
+                    removed.append(point)
+            elif point.synced is None:
+                added.append(point)
+            elif (point.count, point.dominates) != point.synced:
+                # points that absorbed duplicates or dominated more
+                # points since the last sync are sent again (removed
+                # and added) so that the master gets the new count and
+                # score
+                added.append(point)
+                removed.append(point)
+        for point in departed:
+            # the master won't have it if it comes back later
+            point.synced = None
+            removed.append(point)
+        return added, removed, shown
+
     def get_master_updates(self):
         """Update the local skyline based on points from the master/central
         node's skyline
 
         To get the skyline, we will query the master server a total of
-        WORKER_REQUERIES times and wait WORKER_MASTER_WAIT seconds
-        before declaring failure/ raising an exception
+        WORKER_REQUERIES times before declaring failure/ raising an
+        exception. With long polling, the master holds each query until
+        the step is done (for up to LONG_POLL_WAIT seconds). Otherwise,
+        we wait UPLOAD_WAIT seconds first and WORKER_MASTER_WAIT
+        seconds after each query that finds the master still computing
 
         We will perform the following activities here
         1) update local skyline based on master updates
         2) expire old points
 
         """
+        self.apply_master_updates(self.fetch_master_updates())
+
+    def fetch_master_updates(self):
+        """Return the master's changes for this step"""
         self.logger.debug("Starting to get master updates")
         params = {'worker_id': self.worker_id}
+        timeout = SERVER_TIMEOUT
+        if self.long_poll:
+            params['wait'] = LONG_POLL_WAIT
+            timeout += LONG_POLL_WAIT
+        else:
+            self.logger.debug("Starting to wait on upload for {}"
+                              "".format(UPLOAD_WAIT))
+            time.sleep(UPLOAD_WAIT)
         for x in range(WORKER_REQUERIES):
-            url = "{}/get_skyline/{}".format(self.master_url, self.step)
-            req = requests.get(url, timeout=SERVER_TIMEOUT, params=params)
+            path = "/get_skyline/{}".format(self.step)
+            req = self.transport.get(path, timeout=timeout, params=params)
 
             # if we got a successful response, then let's break out
             if req.status_code == 200:
@@ -262,76 +644,151 @@ class Worker():
             elif req.status_code == 423:
                 self.logger.debug("Received wait command from master when "
                                   "starting update from master")
-                time.sleep(WORKER_MASTER_WAIT)
+                if not self.long_poll:
+                    time.sleep(WORKER_MASTER_WAIT)
             # otherwise, just break out now with an error
             else:
                 req.raise_for_status()
 
-        data = req.json()
+        data = self.transport.read_message(req)
         self.logger.debug("Receieved master update: {}".format(data))
-        self.step += 1
+        return data
 
-        # handle the removals and additions in a single pass
-        to_remove, old_skys = {}, {}
-        for point in data['removed']:
-            to_remove[tuple(point['data'])] = point
-
-        to_see = self.sky.skyline.qsize()
-        for idx in range(to_see):
-            point = self.sky.skyline.get_nowait()
-            if tuple(point['data']) in to_remove:
-                continue
-            self.sky.skyline.put(point)
-            step = tuple([point['step']])
-            old_skys[tuple(point['data']) + step] = point
-        for point in data['added']:
-            self.sky.skyline.put(point)
-            step = tuple([point['step']])
-            old_skys[tuple(point['data']) + step] = point
+    def apply_master_updates(self, data):
+        """Apply the master's changes and move on to the next step"""
+        self.record_transfers()
+        self.step += 1
 
         # now that we have the global skyline from the previous
         # timestep, let's create a datastructure to snapshot what we
         # will later add and remove
-        self.old_skys = old_skys
+        self.sync_skyline(self.sky, data, self.uploaded)
+        if self.cube is not None:
+            for key in self.cube.keys():
+                self.sync_skyline(self.cube.skys[key], data['cube'][key],
+                                  self.cube.uploaded[key])
 
         # expire points from the skyline
         self.expire_points()
 
+    def record_transfers(self):
+        """Log what went back and forth with the master since the last
+        call (normally, one step's exchange), and record it in metrics
+
+        The round trip time of a long poll (see fetch_master_updates)
+        includes waiting on the master to finish the step
+
+        """
+        transfers = self.transport.take_transfers()
+        if len(transfers) == 0:
+            return
+        sent = sum(transfer.sent for transfer in transfers)
+        raw_sent = sum(transfer.raw_sent for transfer in transfers)
+        received = sum(transfer.received for transfer in transfers)
+        rtt = sum(transfer.rtt for transfer in transfers)
+        self.logger.info("Step {}: sent {} bytes ({} uncompressed) and "
+                         "received {} bytes in {} requests, {:.3f}s round "
+                         "trip".format(self.step, sent, raw_sent, received,
+                                       len(transfers), rtt))
+        if self.metrics is not None:
+            self.metrics.observe('bytes_sent', sent)
+            self.metrics.observe('bytes_received', received)
+            self.metrics.incr('bytes_uncompressed', raw_sent)
+            for transfer in transfers:
+                self.metrics.observe(transfer.name + '_rtt', transfer.rtt)
+
+    def sync_skyline(self, sky, changes, uploaded):
+        """Apply the master's changes to sky and record what the master
+        now has of each point in SkyPoint.synced
+
+        uploaded is the set of points we last sent for sky, which is
+        all that the master knows about in top k mode (None otherwise)
+
+        """
+        # handle the removals and the snapshot in a single pass (the
+        # spill engine writes the points it keeps back to disk, with
+        # their synced counts)
+        to_remove = set(point.data for point in changes['removed'])
+
+        def keep(point):
+            # our own points that the master removed may come back
+            # (see below), and it won't have them then either
+            point.synced = None
+            if point.data in to_remove:
+                return False
+            if uploaded is None or point in uploaded:
+                point.synced = (point.count, point.dominates)
+            return True
+        removed = sky.skyline.retain(keep)
+        for point in changes['added']:
+            # the worker that owns the point already reported its
+            # count and score, so we only count what we see from here
+            point.count, point.dominates = 0, 0
+            point.synced = (0, 0)
+            sky.skyline.put(point)
+
+        # the candidates that depended on the points the master removed
+        # need a new dominator from the updated skyline. So do our own
+        # points that it removed (the ones from other workers have no
+        # count here), which are dominated by points from other workers
+        # and have to become their candidates, or they would be lost
+        # when those points expire
+        if len(removed) > 0:
+            own = [point for point in removed if point.count > 0]
+            self.promote_candidates(sky.non_sky.release(removed) + own, sky)
+
     def expire_points(self):
         """Expire old points from the skyline"""
 
         self.logger.debug("Starting to expire points for step {}"
                           "(anything less than {})"
                           "".format(self.step, self.step - self.win_size))
-        has_expired = False
-        to_see = self.sky.skyline.qsize()
-        # while not self.sky.skyline.empty():
-        for x in range(to_see):
-            item = self.sky.skyline.get_nowait()
-            if item['step'] <= (self.step - self.win_size):
-                has_expired = True
-                # self.logger.debug("Expiring point {} at step {}"
-                #                   "".format(item, self.step))
-            else:
-                self.sky.skyline.put(item)
+        oldest_step = self.step - self.win_size
+        self.expire_skyline(self.sky, oldest_step)
+        if self.cube is not None:
+            for key in self.cube.keys():
+                self.expire_skyline(self.cube.skys[key], oldest_step)
+
+    def expire_skyline(self, sky, oldest_step):
+        """Expire the points of sky from before oldest_step"""
+        expired = sky.expire_steps(oldest_step)
+        self.logger.debug("Points alive per step: {}"
+                          "".format(sky.step_stats()))
+
+        # drop the candidates that newer points have made useless, so
+        # that non_sky stays about the size of the real candidate set
+        # (this is free on steps where neither store took new points)
+        dropped = sky.compact_candidates()
+        self.logger.debug("Dropped {} candidates, {} left"
+                          "".format(dropped, sky.non_sky.qsize()))
 
         # if we have not expired any skyline points, then we don't
         # need to check the non-skyline points and we are done
-        if not has_expired:
+        if len(expired) == 0:
             # self.logger.debug("No expiration points found")
             return
 
-        # rerun and expire all of the non-skyline points in a single
-        # check
-        to_see = self.sky.non_sky.qsize()
-        # while not self.sky.non_sky.empty():
-        for x in range(to_see):
-            item = self.sky.non_sky.get_nowait()
-            # self.logger.debug("testing non sky point: {}".format(item))
-            if item['step'] <= (self.step - self.win_size):
-                has_expired = True
-            else:
-                self.update_skyline(item)
+        # rerun the candidates that depended on the expired points in a
+        # single batch and expire the old ones. Candidates dominated by
+        # points that are still in the skyline are left alone
+        candidates = sky.non_sky.release(expired)
+        candidates = [item for item in candidates
+                      if item.step > oldest_step]
+        self.promote_candidates(candidates, sky)
+
+    def promote_candidates(self, candidates, sky):
+        """Rerun released candidates through sky (the full skyline or
+        one of the subspace ones)
+
+        The candidates already hang off dominators and carry credits
+        from other steps, so they skip the parallel prefilter (see
+        ParallelFilter) and go straight to the skyline
+
+        """
+        added = sky.update_sky_for_points(candidates)
+        if self.metrics is not None:
+            self.metrics.incr('released', len(candidates))
+            self.metrics.incr('promotions', len(added))
 
     def update_skyline(self, point):
         """Update the local skyline based on this point
@@ -346,15 +803,62 @@ class Worker():
         # self.logger.debug("Added: {} skyline for point: {}"
         #                   "".format(added, point))
 
+    def update_skyline_batch(self, points, cube=True):
+        """Update the local skyline based on a batch of points (usually
+        all of the points for a step), and the subspace skylines too
+        unless cube is False
 
-def run_worker(infile, master, work_id=None):
+        Returns the points from the batch that were added to the skyline
+
+        """
+        if len(points) == 0:
+            return []
+        if self.staging is not None:
+            return self.stage_points(points, cube)
+        # the subspace skylines go first, since the prefilter drops
+        # points that are only dominated in the full space
+        if cube and self.cube is not None:
+            self.cube.update_sky_for_points(points)
+        if self.parallel is not None:
+            points = self.parallel.prefilter(points)
+        return self.sky.update_sky_for_points(points)
+
+    def stage_points(self, points, cube=True):
+        """Update the staging skylines (see start_staging) with a batch
+        of points and return the ones that were added
+
+        """
+        if cube and self.staging_cube is not None:
+            self.staging_cube.update_sky_for_points(points)
+        if self.parallel is not None:
+            points = self.parallel.prefilter(points)
+        return self.staging.update_sky_for_points(points)
+
+
+def run_worker(infile, master, work_id=None, engine=SKY_ENGINE, procs=1,
+               partition='angle', metrics_file=METRICS_FILE,
+               line_format='dur_count', per_line=False, mmap_input=False,
+               read_ahead=0, async_sync=False, long_poll=True,
+               compression=COMPRESSION, wire_format=WIRE_FORMAT,
+               spill_budget=SPILL_BUDGET):
+    parser = None
+    if not per_line:
+        parser = BLOCK_FORMATS.get(line_format)
     worker = Worker(infile, master, work_id=work_id,
-                    process_line=proc_dur_count)
+                    process_line=LINE_FORMATS[line_format], engine=engine,
+                    procs=procs, partition=partition,
+                    metrics_file=metrics_file, parser=parser,
+                    mmap_input=mmap_input, read_ahead=read_ahead,
+                    async_sync=async_sync, long_poll=long_poll,
+                    compression=compression, wire_format=wire_format,
+                    spill_budget=spill_budget)
     prof = line_profiler.LineProfiler(worker.run, worker.upload_data,
                                       worker.find_skyline_diff,
                                       worker.get_master_updates,
                                       worker.expire_points,
                                       worker.update_skyline,
+                                      worker.update_skyline_batch,
+                                      worker.sky.update_sky_for_points,
                                       worker.sky.update_sky_for_point,
                                       worker.sky.check_dominated)
     prof.enable()
@@ -373,6 +877,50 @@ def parse_args():
                         help='Base of URL for accessing master')
     parser.add_argument('--id', default=None,
                         help='manually specify the worker id')
+    parser.add_argument('--engine', default=SKY_ENGINE,
+                        help='skyline engine to use (auto, bnl, vector, '
+                        'staircase, kdtree, spill, or bitmap)')
+    parser.add_argument('--procs', type=int, default=1,
+                        help='number of processes to compute each step\'s '
+                        'skyline with')
+    parser.add_argument('--partition', default='angle',
+                        help='how to split points across processes (angle '
+                        'or grid)')
+    parser.add_argument('--metrics', default=METRICS_FILE,
+                        help='file to append skyline metrics to')
+    parser.add_argument('--format', default='dur_count',
+                        choices=sorted(LINE_FORMATS),
+                        help='how to read the input lines (dur_counts '
+                        'reads duration, count, and srv_count for '
+                        'skycubes)')
+    parser.add_argument('--per-line', action='store_true',
+                        help='parse the input one line at a time instead '
+                        'of a block of lines at a time')
+    parser.add_argument('--mmap', action='store_true',
+                        help='memory map the input and parse the columns '
+                        'straight out of it (not with --per-line or the '
+                        'json format)')
+    parser.add_argument('--read-ahead', type=int, default=0,
+                        help='number of blocks to read and parse ahead in '
+                        'a background thread (0 to read them as we go)')
+    parser.add_argument('--async-sync', action='store_true',
+                        help='keep working on the next step while the '
+                        'last one is synced with the master')
+    parser.add_argument('--no-long-poll', dest='long_poll',
+                        action='store_false',
+                        help='sleep and poll for the master\'s skyline '
+                        'instead of having it answer when the step is done')
+    parser.add_argument('--compression', default=COMPRESSION,
+                        choices=['gzip', 'deflate', 'none'],
+                        help='how to compress uploads to the master')
+    parser.add_argument('--wire-format', default=WIRE_FORMAT,
+                        choices=['json', 'columns'],
+                        help='send the skyline changes as JSON or in the '
+                        'binary columnar format (if the master has it)')
+    parser.add_argument('--spill-budget', type=int, default=SPILL_BUDGET,
+                        help='most skyline points that the spill engine '
+                        'keeps in memory (its candidates are all in '
+                        'memory)')
     return parser.parse_args()
 
 
@@ -380,4 +928,13 @@ if __name__ == "__main__":
     # parse the CLI arguments
     args = parse_args()
 
-    run_worker(args.input, args.master, work_id=args.id)
+    run_worker(args.input, args.master, work_id=args.id, engine=args.engine,
+               procs=args.procs, partition=args.partition,
+               metrics_file=args.metrics, line_format=args.format,
+               per_line=args.per_line, mmap_input=args.mmap,
+               read_ahead=args.read_ahead, async_sync=args.async_sync,
+               long_poll=args.long_poll,
+               compression=(None if args.compression == 'none'
+                            else args.compression),
+               wire_format=args.wire_format,
+               spill_budget=args.spill_budget)